@@ -0,0 +1,140 @@
+# Engines the API runs the detector and PR model with
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+import torch
+from transformers import RobertaForSequenceClassification, RobertaTokenizerFast
+
+# Files written by export.py in its output folder, next to the tokenizer files
+EXPORTED_FILENAMES = {
+    "torchscript": ("detector.pt", "pr.pt"),
+    "onnx": ("detector.onnx", "pr.onnx"),
+}
+
+
+class LogisticModel(torch.nn.Module):
+    def __init__(self,model):
+        super().__init__()
+        self.softmax = torch.nn.Softmax(dim=1)
+        self.model = model
+
+    def forward(self, inputs):
+        # Inputs are moved to the device of the model, GPU or CPU
+        device = self.model.device
+        logits = self.model(inputs["input_ids"].to(device),
+         attention_mask=inputs["attention_mask"].to(device)
+        ).logits
+        y_pred = self.softmax(logits)[:,1]
+        return y_pred
+
+
+class Backend(ABC):
+    """Runs the models on the tensors of `tokenizer`.
+    get_probabilities returns the Human and ChatGPT probabilities of each text, with shape (batch, 2).
+    get_polish_ratios returns the polish ratio of each text, with shape (batch,).
+    """
+    tokenizer = None
+
+    @abstractmethod
+    def get_probabilities(self, input_ids, attention_mask) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def get_polish_ratios(self, input_ids, attention_mask) -> np.ndarray:
+        pass
+
+
+class TorchBackend(Backend):
+    """Builds the models from roberta-base and loads the fine-tuned state dicts, optionally quantized to int8 on the CPU."""
+
+    def __init__(self, detector_path, pr_path, device="cpu", quantize=False):
+        self.device = device
+        self.tokenizer = RobertaTokenizerFast.from_pretrained("roberta-base")
+        self.model_det = RobertaForSequenceClassification.from_pretrained("roberta-base").to(device)
+        self.model_PR = LogisticModel(RobertaForSequenceClassification.from_pretrained("roberta-base")).to(device)
+        # map_location loads weights saved from a GPU on the CPU too
+        self.model_det.load_state_dict(torch.load(detector_path, map_location=device))
+        self.model_PR.load_state_dict(torch.load(pr_path, map_location=device))
+        # Disable dropout
+        self.model_det.eval()
+        self.model_PR.eval()
+        if quantize and device == "cpu":
+            self.model_det = torch.quantization.quantize_dynamic(self.model_det, {torch.nn.Linear}, dtype=torch.qint8)
+            self.model_PR = torch.quantization.quantize_dynamic(self.model_PR, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def get_probabilities(self, input_ids, attention_mask):
+        with torch.inference_mode():
+            logits = self.model_det(input_ids.to(self.device), attention_mask=attention_mask.to(self.device)).logits
+            return torch.softmax(logits, dim=1).cpu().numpy()
+
+    def get_polish_ratios(self, input_ids, attention_mask):
+        with torch.inference_mode():
+            return self.model_PR({"input_ids": input_ids, "attention_mask": attention_mask}).cpu().numpy()
+
+
+class TorchScriptBackend(Backend):
+    """Loads the traced models saved by `export.py --format torchscript`, without building them from roberta-base first."""
+
+    def __init__(self, model_dir, device="cpu"):
+        self.device = device
+        self.tokenizer = RobertaTokenizerFast.from_pretrained(model_dir)
+        detector_filename, pr_filename = EXPORTED_FILENAMES["torchscript"]
+        self.model_det = torch.jit.load(os.path.join(model_dir, detector_filename), map_location=device)
+        self.model_PR = torch.jit.load(os.path.join(model_dir, pr_filename), map_location=device)
+
+    def _run(self, model, input_ids, attention_mask):
+        with torch.inference_mode():
+            return model(input_ids.to(self.device), attention_mask.to(self.device)).cpu().numpy()
+
+    def get_probabilities(self, input_ids, attention_mask):
+        return self._run(self.model_det, input_ids, attention_mask)
+
+    def get_polish_ratios(self, input_ids, attention_mask):
+        return self._run(self.model_PR, input_ids, attention_mask)
+
+
+class OnnxBackend(Backend):
+    """Runs the models exported by `export.py --format onnx` with ONNX Runtime, usually faster than PyTorch on the CPU.
+    Requires the `onnxruntime` package, or `onnxruntime-gpu` to run on the GPU.
+    """
+
+    def __init__(self, model_dir, device="cpu", num_threads=0):
+        import onnxruntime
+
+        self.tokenizer = RobertaTokenizerFast.from_pretrained(model_dir)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 uses all cores
+        options.intra_op_num_threads = num_threads
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if device == "cuda" else ["CPUExecutionProvider"]
+        detector_filename, pr_filename = EXPORTED_FILENAMES["onnx"]
+        self.session_det = onnxruntime.InferenceSession(os.path.join(model_dir, detector_filename), options, providers=providers)
+        self.session_PR = onnxruntime.InferenceSession(os.path.join(model_dir, pr_filename), options, providers=providers)
+
+    def _run(self, session, input_ids, attention_mask):
+        inputs = {"input_ids": input_ids.numpy().astype(np.int64), "attention_mask": attention_mask.numpy().astype(np.int64)}
+        return session.run(None, inputs)[0]
+
+    def get_probabilities(self, input_ids, attention_mask):
+        return self._run(self.session_det, input_ids, attention_mask)
+
+    def get_polish_ratios(self, input_ids, attention_mask):
+        return self._run(self.session_PR, input_ids, attention_mask)
+
+
+backends = {"torch": TorchBackend, "torchscript": TorchScriptBackend, "onnx": OnnxBackend}
+
+
+def load_backend(name, detector_path, pr_path, model_dir, device="cpu", num_threads=0, quantize=False):
+    # The torch backend loads the state dicts, the others the models exported to model_dir
+    if name not in backends:
+        raise ValueError(f"Unknown backend {name}, expected one of {list(backends)}.")
+    if quantize and name != "torch":
+        # The exported models are quantized when they are exported
+        raise ValueError(f"Quantization only applies to the torch backend, export quantized models with export.py --quantize for the {name} backend.")
+    if name == "torch":
+        return TorchBackend(detector_path, pr_path, device, quantize)
+    if name == "torchscript":
+        return TorchScriptBackend(model_dir, device)
+    return OnnxBackend(model_dir, device, num_threads)
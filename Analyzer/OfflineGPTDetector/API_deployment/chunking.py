@@ -0,0 +1,117 @@
+# Scoring of documents longer than the 512 tokens of the models, e.g. the whole text of a CV, with overlapping windows
+import numpy as np
+import torch
+
+# Tokens of text in each window, without the <s> and </s> tokens added around them
+WINDOW_TOKENS = 510
+# Tokens shared by consecutive windows, so that sentences cut at the end of a window are seen whole in the next one
+OVERLAP_TOKENS = 128
+AGGREGATIONS = ["mean", "max", "weighted"]
+
+
+def get_windows(token_ids, window_tokens=WINDOW_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    # Split the tokens of a document into overlapping windows, the last one ending with the document.
+    # Returns each window with the number of new tokens it adds, its end minus the end of the previous window, as the last window is
+    # moved back to end with the document and can mostly overlap the previous one
+    stride = window_tokens - overlap_tokens
+    if stride <= 0:
+        raise ValueError(f"The overlap of the windows, {overlap_tokens} tokens, must be shorter than the windows, {window_tokens} tokens.")
+    starts = list(range(0, max(len(token_ids) - window_tokens, 0) + 1, stride))
+    if starts[-1] + window_tokens < len(token_ids):
+        starts.append(len(token_ids) - window_tokens)
+    windows = []
+    previous_end = 0
+    for start in starts:
+        window = token_ids[start:start + window_tokens]
+        windows.append((window, start + len(window) - previous_end))
+        previous_end = start + len(window)
+    return windows
+
+
+def score_documents(backend, texts, batch_size=16, window_tokens=WINDOW_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    """Get the Human and ChatGPT probabilities of each window of each document.
+    The windows of all the documents are run together, sorted by length so that the batches have little padding.
+    Args:
+        backend (Backend): Models and tokenizer, see backends.py.
+        texts (list): Documents, of any length.
+        batch_size (int): Number of windows in each forward pass.
+    Returns:
+        list: For each document, the probabilities of its windows, with shape (windows, 2), and the number of new tokens of its
+            windows, see get_windows.
+    """
+    tokenizer = backend.tokenizer
+    # Tokenized without truncation, the windows are cut from the whole document
+    token_ids_per_text = tokenizer(texts, add_special_tokens=False, truncation=False, verbose=False)["input_ids"]
+
+    windows = []  # (document index, tokens of the window, new tokens of the window)
+    for i, token_ids in enumerate(token_ids_per_text):
+        for window, new_tokens in get_windows(token_ids, window_tokens, overlap_tokens):
+            windows.append((i, [tokenizer.cls_token_id] + window + [tokenizer.sep_token_id], new_tokens))
+    order = sorted(range(len(windows)), key=lambda w: len(windows[w][1]))
+
+    probabilities = np.zeros((len(windows), 2), dtype=np.float32)
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        max_length = max(len(windows[w][1]) for w in batch)
+        input_ids = torch.full((len(batch), max_length), tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), max_length), dtype=torch.long)
+        for row, w in enumerate(batch):
+            window = windows[w][1]
+            input_ids[row, :len(window)] = torch.tensor(window, dtype=torch.long)
+            attention_mask[row, :len(window)] = 1
+        probabilities[batch] = backend.get_probabilities(input_ids, attention_mask)
+
+    documents = [([], []) for _ in texts]
+    for (i, _, new_tokens), window_probabilities in zip(windows, probabilities):
+        documents[i][0].append(window_probabilities)
+        documents[i][1].append(new_tokens)
+    return [(np.array(p), np.array(new_tokens)) for p, new_tokens in documents]
+
+
+def aggregate(probabilities, new_tokens, aggregation="weighted"):
+    """Get the Human and ChatGPT probabilities of a document from those of its windows.
+    Args:
+        probabilities (np.ndarray): Probabilities of the windows, with shape (windows, 2).
+        new_tokens (np.ndarray): Number of tokens each window adds to the previous ones, see get_windows.
+        aggregation (str): "mean" of the windows, "max" ChatGPT probability of the windows, which flags documents with a generated
+            part, or mean "weighted" by the new tokens of the windows, so that each token of the document counts about as much, and
+            a last window that mostly repeats the previous one counts less.
+    """
+    if aggregation == "mean":
+        return probabilities.mean(axis=0)
+    if aggregation == "max":
+        chatgpt = float(probabilities[:, 1].max())
+        return np.array([1 - chatgpt, chatgpt])
+    if aggregation == "weighted":
+        # Documents without tokens have a single empty window
+        weights = new_tokens if new_tokens.sum() > 0 else np.ones_like(new_tokens)
+        return np.average(probabilities, axis=0, weights=weights)
+    raise ValueError(f"Unknown aggregation {aggregation}, expected one of {AGGREGATIONS}.")
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    from backends import backends, load_backend
+
+    parser = argparse.ArgumentParser(description="Score long documents, e.g. the text extracted from the pdfs of candidates, one per text file.")
+    parser.add_argument("files", nargs="+", help="Text files, each one a document.")
+    parser.add_argument("--backend", choices=list(backends), default="torch", help="Engine of the models, see backends.py.")
+    parser.add_argument("--detector", default="../Detecting-Generated-Abstract-main/best_model_paper.pt", help="State dict of the detector, for the torch backend.")
+    parser.add_argument("--model-dir", default="exported", help="Folder of the exported models, for the other backends.")
+    parser.add_argument("--device", default="cpu", help='Device to run the model on, "cpu" or "cuda".')
+    parser.add_argument("--threads", type=int, default=0, help="Number of threads used on the CPU, all cores by default.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Number of windows in each forward pass.")
+    parser.add_argument("--overlap", type=int, default=OVERLAP_TOKENS, help="Tokens shared by consecutive windows.")
+    args = parser.parse_args()
+
+    if args.device == "cpu" and args.threads:
+        torch.set_num_threads(args.threads)
+    backend = load_backend(args.backend, args.detector, "../regress/last_model_reg_MSE.pt", args.model_dir, args.device, args.threads)
+    texts = []
+    for filepath in args.files:
+        with open(filepath, encoding="utf-8") as f:
+            texts.append(f.read())
+    for filepath, (probabilities, new_tokens) in zip(args.files, score_documents(backend, texts, args.batch_size, overlap_tokens=args.overlap)):
+        scores = ", ".join(f"{aggregation} {aggregate(probabilities, new_tokens, aggregation)[1]:.4f}" for aggregation in AGGREGATIONS)
+        print(f"{os.path.basename(filepath)}: {len(new_tokens)} windows, ChatGPT probability {scores}")
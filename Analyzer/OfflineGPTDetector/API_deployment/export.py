@@ -0,0 +1,80 @@
+# Export the detector and PR model to self-contained TorchScript or ONNX files, served by the torchscript and onnx backends of the API
+import os
+
+import torch
+from transformers import RobertaForSequenceClassification, RobertaTokenizer
+
+from backends import EXPORTED_FILENAMES, LogisticModel
+
+
+class ExportedModel(torch.nn.Module):
+    """Takes the input_ids and attention_mask tensors rather than the dictionary of the tokenizer, and returns the probabilities of the
+    classifier, or only the ChatGPT one for the PR model, as LogisticModel does.
+    """
+
+    def __init__(self, classifier, polish_ratio=False):
+        super().__init__()
+        self.classifier = classifier
+        self.polish_ratio = polish_ratio
+
+    def forward(self, input_ids, attention_mask):
+        # Classifiers loaded with torchscript=True return tuples, whose first item is the logits
+        probabilities = torch.softmax(self.classifier(input_ids, attention_mask=attention_mask)[0], dim=1)
+        return probabilities[:, 1] if self.polish_ratio else probabilities
+
+
+def load_models(detector_path, pr_path):
+    # Load the fine-tuned models on the CPU, with torchscript=True so that they can be traced
+    model_det = RobertaForSequenceClassification.from_pretrained("roberta-base", torchscript=True)
+    model_det.load_state_dict(torch.load(detector_path, map_location="cpu"))
+    model_PR = LogisticModel(RobertaForSequenceClassification.from_pretrained("roberta-base", torchscript=True))
+    model_PR.load_state_dict(torch.load(pr_path, map_location="cpu"))
+    return ExportedModel(model_det).eval(), ExportedModel(model_PR.model, polish_ratio=True).eval()
+
+
+def export(detector_path, pr_path, output_dir, export_format="onnx", quantize=False):
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
+    # Saved with the models, so that the API doesn't need roberta-base
+    tokenizer.save_pretrained(output_dir)
+
+    # Texts of different lengths, so that the example batch has padding
+    example = tokenizer(["An example text.", "A longer example text, to trace the models with padded inputs."],
+                        return_tensors="pt", padding=True)
+    example_inputs = (example["input_ids"], example["attention_mask"])
+
+    for model, filename in zip(load_models(detector_path, pr_path), EXPORTED_FILENAMES[export_format]):
+        filepath = os.path.join(output_dir, filename)
+        if export_format == "torchscript":
+            if quantize:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            with torch.no_grad():
+                traced = torch.jit.trace(model, example_inputs)
+            torch.jit.save(torch.jit.freeze(traced), filepath)
+        else:
+            # The batch and sequence dimensions can change from one call to the next
+            torch.onnx.export(
+                model, example_inputs, filepath,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["probabilities"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                              "probabilities": {0: "batch"}},
+                opset_version=14,
+            )
+            if quantize:
+                # PyTorch can't export its quantized layers to ONNX, ONNX Runtime quantizes the exported graph instead
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(filepath, filepath, weight_type=QuantType.QInt8)
+        print(f"Exported {filepath}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export the detector and PR model for the torchscript and onnx backends of the API.")
+    parser.add_argument("--detector", default="../Detecting-Generated-Abstract-main/best_model_paper.pt", help="State dict of the fine-tuned detector.")
+    parser.add_argument("--pr", default="../regress/last_model_reg_MSE.pt", help="State dict of the trained PR model.")
+    parser.add_argument("--output", default="exported", help="Folder where the models and the tokenizer are saved.")
+    parser.add_argument("--format", choices=list(EXPORTED_FILENAMES), default="onnx", help="Format of the exported models.")
+    parser.add_argument("--quantize", action="store_true", help="Quantize the Linear layers of the models to int8, for the CPU.")
+    args = parser.parse_args()
+    export(args.detector, args.pr, args.output, args.format, args.quantize)
@@ -1,22 +1,32 @@
-from fastapi import FastAPI
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from transformers import RobertaForSequenceClassification, RobertaTokenizer
 import torch
 import numpy as np
-from typing import List
-
-class LogisticModel(torch.nn.Module):  
-    def __init__(self,model):
-        super().__init__()  
-        self.softmax = torch.nn.Softmax(dim=1)  
-        self.model = model
- 
-    def forward(self, inputs):
-        logits = self.model(inputs["input_ids"].cuda(),
-         attention_mask=inputs["attention_mask"].cuda()
-        ).logits
-        y_pred = self.softmax(logits)[:,1]
-        return y_pred
+from typing import Callable, List
+
+from backends import load_backend
+from chunking import AGGREGATIONS, aggregate, score_documents
+
+# Texts of concurrent requests are run through the model together, in batches of at most MAX_BATCH_SIZE texts.
+# A batch waits at most MAX_WAIT_MS for more texts after its first one.
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 16))
+MAX_WAIT_MS = float(os.environ.get("MAX_WAIT_MS", 10))
+# Device the models run on, e.g. "cpu" on CPU-only servers. The GPU if there is one by default.
+DEVICE = os.environ.get("DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+# Threads used by each forward pass on the CPU, e.g. the number of physical cores given to the server. All cores by default.
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", 0))
+# Quantize the Linear layers of the models to int8 on the CPU, usually 2 to 4 times faster. Check the accuracy change with Detector/quantize.py first.
+# Only for the torch backend: the other backends load models quantized by `export.py --quantize`, and refuse to start with QUANTIZE=1.
+QUANTIZE = os.environ.get("QUANTIZE", "0") == "1"
+# Engine of the models, see backends.py: "torch" loads the state dicts below, "torchscript" and "onnx" the models exported
+# to MODEL_DIR by export.py, which start faster and, for onnx, usually run faster on the CPU.
+BACKEND = os.environ.get("BACKEND", "torch")
+MODEL_DIR = os.environ.get("MODEL_DIR", "exported")
+DETECTOR_PATH = "../Detecting-Generated-Abstract-main/best_model_paper.pt"
+PR_PATH = "../regress/last_model_reg_MSE.pt"
 
 def sigmoid(x):
     return 1 / (1 + np.exp(-x))
@@ -35,64 +45,162 @@ def preprocess_text(tokenizer, input_text, max_length):
     return inputs
 
 
-def get_prediction(model, input_ids, attention_mask):
-    # Get the predicted label using the input_ids and attention_mask
-    softmax = torch.nn.Softmax(dim=1)
-    outputs = model(input_ids, attention_mask=attention_mask)
-    score = softmax(outputs.logits)
-    score = score.detach().cpu().numpy()[0]
-    return[{"label":"Human","score":float(score[0])},{"label":"ChatGPT","score":float(score[1])}]
-    '''
-    if predicted_label == 0:
-            return "Human"
-    else:
-        return "ChatGPT"
-    '''
-    
-
-def get_PR(model, inputs):
-    # Get the predicted label using the input_ids and attention_mask
-    outputs = model(inputs)
-    predicted_score = outputs.detach().cpu().numpy()
-    return predicted_score
+def get_predictions(backend, input_ids, attention_mask):
+    # Get the Human and ChatGPT scores of a batch of padded texts
+    scores = backend.get_probabilities(input_ids, attention_mask)
+    return [[{"label":"Human","score":float(score[0])},{"label":"ChatGPT","score":float(score[1])}] for score in scores]
+
+
+class MicroBatcher:
+    """Groups the texts of concurrent requests into batches, runs each batch in a worker thread so that the event loop keeps
+    accepting requests during inference, and returns its result to each caller.
+    Args:
+        predict_batch (Callable): Function returning the results of a list of texts, in the same order.
+        max_batch_size (int): Maximum number of texts in a batch.
+        max_wait_s (float): Maximum time to wait for more texts once a batch has its first text, in seconds.
+        executor (ThreadPoolExecutor): Thread the batches are run in, shared by the batchers of a same model. Not shut down by `stop`.
+    """
+
+    def __init__(self, predict_batch: Callable[[List[str]], list], max_batch_size: int, max_wait_s: float,
+                 executor: ThreadPoolExecutor):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+        self.queue = None
+        self._task = None
+        self._executor = executor
+
+    def start(self):
+        # Created here, as the queue must belong to the event loop of the server.
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def predict(self, texts: List[str]) -> list:
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        for text, future in zip(texts, futures):
+            self.queue.put_nowait((text, future))
+        return list(await asyncio.gather(*futures))
+
+    async def _get_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            # Texts queued while the previous batch was running are taken without waiting.
+            if self.queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self.queue.get_nowait())
+        # Skip the texts of requests that were cancelled, e.g. because the client disconnected.
+        return [(text, future) for text, future in batch if not future.done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._get_batch()
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self._executor, self.predict_batch, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def predict_batch(texts):
+    # Pad the texts to the longest one in the batch
+    inputs = backend.tokenizer(
+        texts,
+        add_special_tokens=True,
+        return_tensors="pt",
+        max_length=512,
+        truncation=True,
+        padding=True,
+    )
+    return get_predictions(backend, inputs["input_ids"], inputs["attention_mask"])
+
+
+def score_document_batch(texts):
+    # Windows of all the documents are run together, in batches of MAX_BATCH_SIZE windows
+    return score_documents(backend, texts, MAX_BATCH_SIZE)
+
 
 # 创建一个FastAPI应用
 app = FastAPI()
+# A single thread runs the batches of both batchers, as running batches concurrently would only compete for the same cores or GPU
+executor = ThreadPoolExecutor(max_workers=1)
+batcher = MicroBatcher(predict_batch, MAX_BATCH_SIZE, MAX_WAIT_MS / 1000, executor)
+# Documents of concurrent requests are scored together too
+document_batcher = MicroBatcher(score_document_batch, MAX_BATCH_SIZE, MAX_WAIT_MS / 1000, executor)
 
-# 在启动时加载模型和tokenizer
-tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
-model_det = RobertaForSequenceClassification.from_pretrained("roberta-base")
-model_PR = LogisticModel(RobertaForSequenceClassification.from_pretrained("roberta-base"))
+# 在启动时加载模型和tokenizer, see load_model
+backend = None
 
 # 创建一个用于接收用户请求的数据模型
 class Item(BaseModel):
     texts: List[str]
 
 
+class DocumentItem(BaseModel):
+    texts: List[str]
+    # How the scores of the windows of a document are combined, see chunking.aggregate
+    aggregation: str = "weighted"
+
+
 @app.on_event("startup")
 async def load_model():
+    global backend
     # 在启动时加载模型到显存
-    model_det.to('cuda')
-    model_PR.to('cuda')
-    model_det.load_state_dict(torch.load("../Detecting-Generated-Abstract-main/best_model_paper.pt"))
-    model_PR.load_state_dict(torch.load("../regress/last_model_reg_MSE.pt"))
-    
+    if DEVICE == "cpu" and TORCH_NUM_THREADS:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+    backend = load_backend(BACKEND, DETECTOR_PATH, PR_PATH, MODEL_DIR, DEVICE, TORCH_NUM_THREADS, QUANTIZE)
+    batcher.start()
+    document_batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await document_batcher.stop()
+    await batcher.stop()
+    executor.shutdown()
+
 
 @app.post("/predict")
 async def predict(item: Item):
     # 接收用户的请求，将用户的文本送入模型，然后将结果返回给用户
-    text_list = item.texts
-    resuls=[]
-    for text in text_list:
-        inputs = preprocess_text(
-                    tokenizer, text, max_length=512
-                )
-        input_ids = inputs["input_ids"].cuda()
-        attention_mask = inputs["attention_mask"].cuda()
-        predicted_label = get_prediction(model_det, input_ids, attention_mask)
-        resuls.append(predicted_label)
-        #resuls.append({"label":predicted_label})
-    return resuls
+    # The texts are batched with those of concurrent requests, see MicroBatcher
+    return await batcher.predict(item.texts)
+
+
+@app.post("/predict_document")
+async def predict_document(item: DocumentItem):
+    # Score texts longer than the 512 tokens seen by /predict, e.g. the whole text of a CV, from overlapping windows of 512 tokens
+    if item.aggregation not in AGGREGATIONS:
+        raise HTTPException(status_code=422, detail=f"Unknown aggregation {item.aggregation}, expected one of {AGGREGATIONS}.")
+    results = []
+    for probabilities, new_tokens in await document_batcher.predict(item.texts):
+        score = aggregate(probabilities, new_tokens, item.aggregation)
+        results.append([{"label":"Human","score":float(score[0])},{"label":"ChatGPT","score":float(score[1])}])
+    return results
 
 '''
 if __name__ == "__main__":
@@ -4,18 +4,31 @@ import torch
 from transformers import RobertaForSequenceClassification, RobertaTokenizer
 
 
-def load_model(model_path):
+def get_device(device=None, num_threads=None):
+    # Use the GPU if there is one, unless a device is given, e.g. "cpu" on CPU-only servers
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(device)
+    if device.type == "cpu" and num_threads:
+        # Threads used by each forward pass, e.g. the number of physical cores given to this process
+        torch.set_num_threads(num_threads)
+    return device
+
+
+def load_model(model_path, device=None):
     # Load the tokenizer and model from the "roberta-base" pre-trained model
+    device = device or get_device()
     tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
-    model = RobertaForSequenceClassification.from_pretrained("roberta-base").cuda()
+    model = RobertaForSequenceClassification.from_pretrained("roberta-base").to(device)
 
-    # Load the saved state dict of the fine-tuned model
-    model.load_state_dict(torch.load(model_path))
+    # Load the saved state dict of the fine-tuned model, on the device of the model whichever device it was saved from
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.eval()
 
     return tokenizer, model
 
 
-def preprocess_text(tokenizer, input_text, max_length):
+def preprocess_text(tokenizer, input_text, max_length, device="cpu"):
     # Tokenize the input text using the tokenizer
     inputs = tokenizer.encode_plus(
         input_text,
@@ -26,23 +39,25 @@ def preprocess_text(tokenizer, input_text, max_length):
     )
 
     # Get the input_ids and attention_mask tensors
-    return inputs["input_ids"].cuda(), inputs["attention_mask"].cuda()
+    return inputs["input_ids"].to(device), inputs["attention_mask"].to(device)
 
 
 def get_prediction(model, input_ids, attention_mask):
-    # Get the predicted label using the input_ids and attention_mask
-    outputs = model(input_ids, attention_mask=attention_mask)
+    # Get the predicted label using the input_ids and attention_mask, without tracking gradients
+    with torch.inference_mode():
+        outputs = model(input_ids, attention_mask=attention_mask)
     predicted_label = np.argmax(outputs.logits.detach().cpu().numpy())
     return predicted_label
 
 
-def main():
+def main(device=None, num_threads=None):
     print("Running the inference script...")
     # Load the fine-tuned model from the saved state dict
     import os
     model_path = os.path.abspath("Detector/PR_model_MSE.pt")
     
-    tokenizer, model = load_model(model_path)
+    device = get_device(device, num_threads)
+    tokenizer, model = load_model(model_path, device)
 
     # Get the test sentence from the file
     with open("text_test.txt", encoding="utf-8", mode="r") as fr:
@@ -51,7 +66,7 @@ def main():
             test_sentence = line.strip()
             # Preprocess the test sentence and get the predicted label
             input_ids, attention_mask = preprocess_text(
-                tokenizer, test_sentence, max_length=512
+                tokenizer, test_sentence, max_length=512, device=device
             )
             predicted_label = get_prediction(model, input_ids, attention_mask)
 
@@ -63,4 +78,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default=None, help='Device to run the model on, e.g. "cpu". The GPU if there is one by default.')
+    parser.add_argument("--threads", type=int, default=None, help="Number of threads used on the CPU.")
+    args = parser.parse_args()
+    main(args.device, args.threads)
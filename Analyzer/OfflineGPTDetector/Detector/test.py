@@ -6,18 +6,22 @@ from sklearn import metrics
 from sklearn.metrics import classification_report
 import json
 
+from inference import get_device
 
-def load_model(model_path):
+
+def load_model(model_path, device=None):
     # Load the tokenizer and model from the "roberta-base" pre-trained model
+    device = device or get_device()
     tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
-    model = RobertaForSequenceClassification.from_pretrained("roberta-base").cuda()
+    model = RobertaForSequenceClassification.from_pretrained("roberta-base").to(device)
     # Load the saved state dict of the fine-tuned model
-    model.load_state_dict(torch.load(model_path))
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.eval()
 
     return tokenizer, model
 
 
-def preprocess_text(tokenizer, input_text, max_length):
+def preprocess_text(tokenizer, input_text, max_length, device="cpu"):
     # Tokenize the input text using the tokenizer
     inputs = tokenizer.encode_plus(
         input_text,
@@ -28,35 +32,33 @@ def preprocess_text(tokenizer, input_text, max_length):
     )
 
     # Get the input_ids and attention_mask tensors
-    return inputs["input_ids"].cuda(), inputs["attention_mask"].cuda()
+    return inputs["input_ids"].to(device), inputs["attention_mask"].to(device)
 
 
 def get_prediction(model, input_ids, attention_mask):
     # Get the predicted label using the input_ids and attention_mask
-    outputs = model(input_ids, attention_mask=attention_mask)
+    with torch.inference_mode():
+        outputs = model(input_ids, attention_mask=attention_mask)
     logits = outputs.logits
     score = torch.sigmoid(logits).detach().cpu().numpy()
     predicted_label = np.argmax(logits.detach().cpu().numpy())
     return predicted_label,float(score[0][1])
 
 
-def test(model_path,test_data_path):
+def evaluate(tokenizer, model, test_data_path, device="cpu", limit=None):
+    # Get the true labels, predicted labels and ChatGPT scores of the test set, and the samples predicted wrong
     predictions = []
     true_labels = []
     score = []
     error_samples = []
-    # Load the fine-tuned model from the saved state dict
-    tokenizer, model = load_model(model_path)
-
-    # Get the test sentence from the file
     with open(test_data_path, encoding="utf-8", mode="r") as fp:
         info = json.load(fp)
-        for data in info:
+        for data in info[:limit]:
             test_sentence = data["text"]
             label = data["fake"]
             # Preprocess the test sentence and get the predicted label
             input_ids, attention_mask = preprocess_text(
-                tokenizer, test_sentence, max_length=512
+                tokenizer, test_sentence, max_length=512, device=device
             )
             predicted_label,logits = get_prediction(model, input_ids, attention_mask)
             true_labels.append(label)
@@ -64,11 +66,26 @@ def test(model_path,test_data_path):
             score.append(logits)
             if predicted_label != label:
                 error_samples.append(data)
-    fp.close()
+    return true_labels, predictions, score, error_samples
+
+
+def print_report(true_labels, predictions, score):
+    # Print the classification report and AUC, and return the AUC
     report = classification_report(true_labels, predictions, digits=4)
     auc = metrics.roc_auc_score(true_labels,score)
     print(report)
     print("AUC:",auc)
+    return auc
+
+
+def test(model_path,test_data_path,device=None,num_threads=None):
+    # Load the fine-tuned model from the saved state dict
+    device = get_device(device, num_threads)
+    tokenizer, model = load_model(model_path, device)
+
+    # Get the test sentence from the file
+    true_labels, predictions, score, error_samples = evaluate(tokenizer, model, test_data_path, device)
+    print_report(true_labels, predictions, score)
         
 
 
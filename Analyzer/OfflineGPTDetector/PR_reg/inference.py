@@ -1,18 +1,25 @@
 # Import required libraries
+import os
+import sys
 import numpy as np
 import torch
 from transformers import RobertaForSequenceClassification, RobertaTokenizer
 from train import LogisticModel
 import json
 
+# get_device is defined with the detector's scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Detector.inference import get_device
 
-def load_model(model_path):
+
+def load_model(model_path, device=None):
     # Load the tokenizer and model from the "roberta-base" pre-trained model
+    device = device or get_device()
     tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
-    model = LogisticModel(RobertaForSequenceClassification.from_pretrained("roberta-base")).cuda()
+    model = LogisticModel(RobertaForSequenceClassification.from_pretrained("roberta-base")).to(device)
 
     # Load the saved state dict of the fine-tuned model
-    model.load_state_dict(torch.load(model_path))
+    model.load_state_dict(torch.load(model_path, map_location=device))
 
     return tokenizer, model
 
@@ -33,14 +40,15 @@ def preprocess_text(tokenizer, input_text, max_length):
 
 def get_prediction(model, inputs):
     # Get the predicted label using the input_ids and attention_mask
-    outputs = model(inputs)
+    with torch.inference_mode():
+        outputs = model(inputs)
     predicted_score = outputs.detach().cpu().numpy()
     return predicted_score
 
 
-def test(model_path,test_data_path):
+def test(model_path,test_data_path,device=None,num_threads=None):
     # Load the fine-tuned model from the saved state dict
-    tokenizer, model = load_model(model_path)
+    tokenizer, model = load_model(model_path, get_device(device, num_threads))
     model.eval()
 
     # Get the test sentence from the file
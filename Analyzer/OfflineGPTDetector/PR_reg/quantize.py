@@ -0,0 +1,78 @@
+# Import required libraries
+import io
+import json
+import time
+
+import numpy as np
+import torch
+from transformers import RobertaForSequenceClassification
+
+from inference import get_device, get_prediction, load_model, preprocess_text
+from train import LogisticModel
+
+
+def quantize_model(model):
+    # Quantize the weights of the Linear layers to int8, activations are quantized on the fly. Only runs on the CPU.
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_quantized_model(quantized_model_path):
+    # Load a PR model saved by `quantize`: the state dict of the quantized model only loads into a model quantized the same way
+    model = quantize_model(LogisticModel(RobertaForSequenceClassification.from_pretrained("roberta-base")))
+    model.load_state_dict(torch.load(quantized_model_path, map_location="cpu"))
+    model.eval()
+    return model
+
+
+def get_model_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1e6
+
+
+def evaluate(tokenizer, model, test_data_path, limit=None):
+    # Get the true and predicted polish ratios of the test set, the Jaccard distance between the human and polished texts
+    true_scores = []
+    predicted_scores = []
+    with open(test_data_path, encoding="utf-8", mode="r") as fp:
+        info = json.load(fp)
+        for data in info[:limit]:
+            inputs = preprocess_text(tokenizer, data["text"], max_length=512)
+            predicted_scores.append(float(get_prediction(model, inputs)[0]))
+            true_scores.append(data["jaccard_distance"])
+    return np.array(true_scores), np.array(predicted_scores)
+
+
+def quantize(model_path, quantized_model_path, test_data_path, num_threads=None, limit=None):
+    # Quantize the PR model, save it, and compare its error and speed on the CPU with the full precision one
+    device = get_device("cpu", num_threads)
+    tokenizer, model = load_model(model_path, device)
+    model.eval()
+    quantized_model = quantize_model(model)
+    torch.save(quantized_model.state_dict(), quantized_model_path)
+
+    predictions = {}
+    durations = {}
+    for name, m in [("fp32", model), ("int8", quantized_model)]:
+        start = time.perf_counter()
+        true_scores, predictions[name] = evaluate(tokenizer, m, test_data_path, limit)
+        durations[name] = time.perf_counter() - start
+        mse = float(np.mean((predictions[name] - true_scores) ** 2))
+        mae = float(np.mean(np.abs(predictions[name] - true_scores)))
+        print(f"{name} model, {get_model_size_mb(m):.0f} MB, {durations[name] / len(true_scores) * 1000:.1f} ms per text: MSE {mse:.5f}, MAE {mae:.5f}")
+
+    print(f"Saved the int8 model to {quantized_model_path}.")
+    print(f"Mean absolute difference between the fp32 and int8 predictions: {np.mean(np.abs(predictions['int8'] - predictions['fp32'])):.5f}, "
+          f"speedup: {durations['fp32'] / durations['int8']:.2f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Quantize the PR model to int8 and compare it with the full precision one on a test set.")
+    parser.add_argument("model_path", help="State dict of the trained PR model.")
+    parser.add_argument("--output", default="last_model_reg_int8.pt", help="Where the state dict of the quantized PR model is saved.")
+    parser.add_argument("--test-data", default="../Dataset/HPPT/test.json", help="Test set, with the text and Jaccard distance of each sample.")
+    parser.add_argument("--threads", type=int, default=None, help="Number of threads used on the CPU.")
+    parser.add_argument("--limit", type=int, default=None, help="Only evaluate the first samples of the test set, for a quicker check.")
+    args = parser.parse_args()
+    quantize(args.model_path, args.output, args.test_data, args.threads, args.limit)
@@ -37,8 +37,10 @@ class LogisticModel(torch.nn.Module):
         self.model = model
  
     def forward(self, inputs):
-        logits = self.model(inputs["input_ids"].cuda(),
-         attention_mask=inputs["attention_mask"].cuda()
+        # Inputs are moved to the device of the model, GPU or CPU
+        device = self.model.device
+        logits = self.model(inputs["input_ids"].to(device),
+         attention_mask=inputs["attention_mask"].to(device)
         ).logits
         y_pred = self.softmax(logits)[:,1]
         return y_pred
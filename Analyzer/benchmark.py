@@ -0,0 +1,298 @@
+# %% Offline benchmark of the extraction, parsing and scoring pipeline, on a synthetic corpus
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from typing import Optional
+
+from main import get_all_candidate_applications
+from pdf_processing import PdfText, get_extraction_options, read_pdf, set_extraction_cache, set_extraction_options
+from extraction_sandbox import set_extraction_sandbox
+from file_processing import get_file_role, get_pdfs_per_id
+from scoring import rate_candidate_applications
+from synthetic_corpus import PROFILES, generate_corpus
+from text_processing import count_buzzwords, find_keywords, get_answers_from_text
+
+# Relative slowdown of a metric, compared to the baseline, reported as a regression.
+DEFAULT_TOLERANCE = 0.2
+
+
+class PeakMemoryMonitor:
+    """Samples in a background thread the memory used by this process and its subprocesses (extraction workers, Tesseract, Poppler)
+    and keeps the peak, in MB.
+    """
+
+    def __init__(self, interval_s: float = 0.05):
+        self.interval_s = interval_s
+        self.peak_rss_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "PeakMemoryMonitor":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        import psutil
+
+        process = psutil.Process()
+        while True:
+            rss = 0
+            for p in [process] + process.children(recursive=True):
+                try:
+                    rss += p.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            self.peak_rss_mb = max(self.peak_rss_mb, rss / (1024 * 1024))
+            if self._stop.wait(self.interval_s):
+                break
+
+
+def get_percentile(values: list[float], percentile: float) -> float:
+    """Percentile of `values` by linear interpolation, between 0 and 100."""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(percentile) - 1]
+
+
+def get_stage_stats(durations_s: list[float], items: Optional[int] = None) -> dict:
+    """Summary of the durations of a stage: number of calls, total time, p50 and p95 latency, and throughput of `items` per second."""
+    total_s = sum(durations_s)
+    stats = {"count": len(durations_s), "total_s": total_s}
+    if durations_s:
+        stats["p50_ms"] = get_percentile(durations_s, 50) * 1000
+        stats["p95_ms"] = get_percentile(durations_s, 95) * 1000
+    if items is not None:
+        stats["items"] = items
+        stats["items_per_s"] = items / total_s if total_s > 0 else 0.0
+    return stats
+
+
+def benchmark_stages(pdfs_per_id: dict[int, list[str]], repeat: int = 1, **read_pdf_kwargs) -> dict[str, dict]:
+    """Time each stage of the pipeline separately, in this process and without the extraction cache: text extraction of every pdf
+    (pages/sec), answer parsing of the applications, keyword search of every text, and rating of all candidates at once.
+    """
+    from main import CandidateApplication
+
+    durations: dict[str, list[float]] = {"extract": [], "parse_answers": [], "find_keywords": [], "rate": []}
+    pages = 0
+    errors = 0
+    for _ in range(repeat):
+        candidate_apps = []
+        for candidate_id, pdfs_paths in pdfs_per_id.items():
+            cand_app = CandidateApplication(candidate_id=candidate_id)
+            for pdf_path in pdfs_paths:
+                start = time.perf_counter()
+                try:
+                    pdf_text: PdfText = read_pdf(pdf_path, **read_pdf_kwargs)
+                except Exception as e:
+                    print(f"Error extracting {pdf_path}. Error: {type(e).__name__} {e.args}")
+                    errors += 1
+                    continue
+                durations["extract"].append(time.perf_counter() - start)
+                pages += pdf_text.page_count
+                if not pdf_text.is_complete():
+                    errors += 1
+                text = pdf_text.get_all_text()
+
+                start = time.perf_counter()
+                keyword_hits = find_keywords(text)
+                cand_app.set_nice_to_haves(text, keyword_hits)
+                cand_app.buzzword_count += count_buzzwords(text, keyword_hits)
+                durations["find_keywords"].append(time.perf_counter() - start)
+
+                if get_file_role(pdf_path) == "application":
+                    start = time.perf_counter()
+                    answers = get_answers_from_text(text)
+                    durations["parse_answers"].append(time.perf_counter() - start)
+                    for i in range(1, 6):
+                        setattr(cand_app, f"answer{i}", answers.get(i))
+            candidate_apps.append(cand_app)
+
+        start = time.perf_counter()
+        rate_candidate_applications(candidate_apps)
+        durations["rate"].append(time.perf_counter() - start)
+
+    candidates = len(pdfs_per_id) * repeat
+    stages = {
+        "extract": get_stage_stats(durations["extract"], items=pages),
+        "parse_answers": get_stage_stats(durations["parse_answers"]),
+        "find_keywords": get_stage_stats(durations["find_keywords"]),
+        "rate": get_stage_stats(durations["rate"], items=candidates),
+    }
+    stages["extract"]["errors"] = errors
+    return stages
+
+
+def benchmark_pipeline(folder_path: str, max_workers: int = 1) -> dict:
+    """Time a whole run of `get_all_candidate_applications` on `folder_path` (candidates/sec), as run by main.py."""
+    start = time.perf_counter()
+    candidate_apps = get_all_candidate_applications(folder_path, max_workers=max_workers)
+    duration_s = time.perf_counter() - start
+    return {"candidates": len(candidate_apps), "duration_s": duration_s,
+            "candidates_per_s": len(candidate_apps) / duration_s if duration_s > 0 else 0.0,
+            "processing_errors": sum(c.has_processing_errors for c in candidate_apps)}
+
+
+def run_benchmark(corpus_dir: str, profile: str, candidates: int, seed: int = 0, repeat: int = 1, max_workers: int = 1,
+                  sandbox: bool = False, tesseract_executable_path: Optional[str] = None, poppler_bin_path: Optional[str] = None) -> dict:
+    """Generate the corpus of a profile in `corpus_dir`, if missing, and benchmark it. The extraction cache is disabled,
+    so that every run measures the extraction itself. The result can be saved as a baseline with `save_results`.
+    The Tesseract and Poppler paths are set in the extraction options, which are handed to the worker processes of the end to end run.
+    """
+    folder_path = os.path.join(corpus_dir, f"{profile}-{candidates}-{seed}")
+    if not os.path.isdir(folder_path):
+        print(f"Generating {candidates} candidates of profile {profile} in {folder_path}.")
+        generate_corpus(folder_path, candidates, profile, seed)
+    pdfs_per_id = get_pdfs_per_id(folder_path)
+
+    set_extraction_cache(None)
+    set_extraction_sandbox(None)
+    options = get_extraction_options()
+    set_extraction_options(options["pdf_backend"], options["ocr_preprocessing"], tesseract_executable_path, poppler_bin_path)
+    try:
+        with PeakMemoryMonitor() as stages_memory:
+            stages = benchmark_stages(pdfs_per_id, repeat)
+
+        if sandbox:
+            from extraction_sandbox import ExtractionSandbox
+            set_extraction_sandbox(ExtractionSandbox())
+        with PeakMemoryMonitor() as pipeline_memory:
+            pipeline = benchmark_pipeline(folder_path, max_workers)
+    finally:
+        set_extraction_sandbox(None)
+        set_extraction_options(**options)
+
+    return {
+        "profile": profile, "candidates": candidates, "seed": seed, "repeat": repeat, "workers": max_workers, "sandbox": sandbox,
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "pages_per_s": stages["extract"]["items_per_s"],
+        "candidates_per_s": pipeline["candidates_per_s"],
+        "stages": stages,
+        "pipeline": pipeline,
+        "peak_rss_mb": {"stages": stages_memory.peak_rss_mb, "pipeline": pipeline_memory.peak_rss_mb},
+    }
+
+
+def save_results(results: list[dict], filepath: str) -> None:
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+
+
+def load_results(filepath: str) -> list[dict]:
+    with open(filepath, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_compared_metrics(result: dict) -> dict[str, tuple[float, bool]]:
+    """Metrics compared to the baseline, with whether higher values are better."""
+    metrics = {"pages_per_s": (result["pages_per_s"], True), "candidates_per_s": (result["candidates_per_s"], True),
+               "peak_rss_mb.pipeline": (result["peak_rss_mb"]["pipeline"], False)}
+    for stage, stats in result["stages"].items():
+        for key in ["p50_ms", "p95_ms"]:
+            if key in stats:
+                metrics[f"{stage}.{key}"] = (stats[key], False)
+    return metrics
+
+
+def get_errors(result: dict) -> list[str]:
+    """Description of the errors of a benchmark run. Runs with errors, e.g. OCR failing because Tesseract is missing, skip work
+    and can look faster than they are, so they are not valid results.
+    """
+    errors = []
+    if result["stages"]["extract"].get("errors"):
+        errors.append(f"{result['profile']}: {result['stages']['extract']['errors']} pdfs failed to extract in the stage benchmark.")
+    if result["pipeline"].get("processing_errors"):
+        errors.append(f"{result['profile']}: {result['pipeline']['processing_errors']} candidates had processing errors end to end.")
+    return errors
+
+
+def find_regressions(results: list[dict], baseline: list[dict], tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """Compare results with a baseline of the same profiles and sizes. Returns a description of each metric worse than the baseline by
+    more than `tolerance`, relatively, and of the errors of the results, see `get_errors`. Results without a matching baseline are not compared.
+    """
+    def get_key(result: dict) -> tuple:
+        return result["profile"], result["candidates"], result["seed"], result["workers"], result["sandbox"]
+
+    baseline_per_key = {get_key(b): b for b in baseline}
+    regressions = []
+    for result in results:
+        regressions += get_errors(result)
+        base = baseline_per_key.get(get_key(result))
+        if base is None:
+            print(f"No baseline for profile {result['profile']} with {result['candidates']} candidates, not compared.")
+            continue
+        base_metrics = get_compared_metrics(base)
+        for name, (value, higher_is_better) in get_compared_metrics(result).items():
+            if name not in base_metrics or base_metrics[name][0] <= 0:
+                continue
+            base_value = base_metrics[name][0]
+            change = (base_value - value) / base_value if higher_is_better else (value - base_value) / base_value
+            if change > tolerance:
+                regressions.append(f"{result['profile']}: {name} is {value:.3f}, baseline {base_value:.3f} ({change:+.0%} worse).")
+    return regressions
+
+
+def print_results(result: dict) -> None:
+    print(f"Profile {result['profile']}, {result['candidates']} candidates:")
+    print(f"\t{result['pages_per_s']:.1f} pages/s extracted, {result['candidates_per_s']:.2f} candidates/s end to end.")
+    for stage, stats in result["stages"].items():
+        if stats["count"]:
+            print(f"\t{stage:<14} p50 {stats['p50_ms']:9.2f} ms, p95 {stats['p95_ms']:9.2f} ms over {stats['count']} calls.")
+    print(f"\tPeak memory {result['peak_rss_mb']['stages']:.0f} MB by stage, {result['peak_rss_mb']['pipeline']:.0f} MB end to end.")
+    for error in get_errors(result):
+        print(f"\tError: {error}")
+
+
+# %%
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on a synthetic corpus, and compare with a saved baseline.")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "cv_analyzer_benchmark"),
+                        help="Folder where the synthetic corpora are generated, and reused by later runs.")
+    parser.add_argument("--profile", nargs="+", choices=PROFILES, default=["text", "long"],
+                        help="Corpus profiles to benchmark. The image and mixed profiles require Tesseract and Poppler.")
+    parser.add_argument("--candidates", type=int, default=50, help="Number of candidates of each corpus.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times each stage is run on the corpus.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes of the end to end run.")
+    parser.add_argument("--sandbox", action="store_true", help="Extract text in the sandbox during the end to end run, as main.py does by default.")
+    parser.add_argument("--tesseract", default=None, help="Path of the Tesseract executable.")
+    parser.add_argument("--poppler", default=None, help="Path of the Poppler bin folder.")
+    parser.add_argument("--output", default=None, help="Json file where the results are written.")
+    parser.add_argument("--save-baseline", default=None, metavar="JSON", help="Json file where the results are saved as the new baseline.")
+    parser.add_argument("--baseline", default=None, metavar="JSON", help="Baseline to compare the results with. Exits with code 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Relative slowdown reported as a regression.")
+    args = parser.parse_args()
+
+    results = []
+    for profile in args.profile:
+        results.append(run_benchmark(args.corpus_dir, profile, args.candidates, args.seed, args.repeat, args.workers, args.sandbox,
+                                     args.tesseract, args.poppler))
+    for result in results:
+        print_results(result)
+
+    if args.output:
+        save_results(results, args.output)
+    if args.save_baseline:
+        if any(get_errors(result) for result in results):
+            print("Warning: the baseline has errors, its timings don't measure the full pipeline.")
+        save_results(results, args.save_baseline)
+        print(f"Baseline saved:\n\t{args.save_baseline}")
+
+    if args.baseline:
+        regressions = find_regressions(results, load_results(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        print(f"{len(regressions)} regressions compared to the baseline.")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,148 @@
+# %% Memory-compact archive of candidate applications, for ranking many candidates at once
+from array import array
+import math
+from typing import Optional
+
+import numpy as np
+
+from main import CandidateApplication
+from scoring import RatingWeights, answer_columns, compute_ratings, mention_columns
+
+flag_columns = mention_columns + ["has_processing_errors"]
+string_columns = ["fullname", "application_filepath", "cv_filepath"]
+
+
+class AnswerStore:
+    """Append-only file of utf-8 texts. Each text is referenced by its offset and size in bytes in the file.
+    Args:
+        filepath (str): Path of the file. Replaced if it exists, as the texts of a previous archive aren't referenced anymore.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._file = open(filepath, "w+b")
+        self._size = 0
+        self._reader = None # opened on the first read
+
+    def __enter__(self) -> "AnswerStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def put(self, text: str) -> tuple[int, int]:
+        """Append a text. Returns its offset and size in bytes."""
+        data = text.encode("utf-8")
+        offset = self._size
+        self._file.write(data)
+        self._size += len(data)
+        return offset, len(data)
+
+    def get(self, offset: int, size: int) -> str:
+        self._file.flush()
+        if self._reader is None:
+            self._reader = open(self.filepath, "rb")
+        self._reader.seek(offset)
+        return self._reader.read(size).decode("utf-8")
+
+    def close(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+        self._file.close()
+
+
+class CandidateArchive:
+    """Struct-of-arrays store of candidate applications: each field is kept in a typed array with one item per candidate, rather than in
+    one object per candidate, and the answers are spilled to an `AnswerStore` on disk. Only their length is kept in memory, which is all
+    that rating needs, so tens of thousands of candidates can be ranked in memory.
+    Args:
+        answers_filepath (str): File where the answers are stored.
+    """
+
+    def __init__(self, answers_filepath: str):
+        self.answer_store = AnswerStore(answers_filepath)
+        self.candidate_id = array("q")
+        self.rating = array("d") # nan if not rated
+        self.buzzword_count = array("q")
+        self.flags = {column: array("b") for column in flag_columns}
+        self.strings: dict[str, list[Optional[str]]] = {column: [] for column in string_columns}
+        # One item per answer, i.e. 5 per candidate. Missing answers have offset -1.
+        self.answer_offsets = array("q")
+        self.answer_sizes = array("q")
+        self.answer_lengths = array("q") # in characters, for rating
+
+    def __len__(self) -> int:
+        return len(self.candidate_id)
+
+    def __enter__(self) -> "CandidateArchive":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def append(self, cand_app: CandidateApplication) -> None:
+        self.candidate_id.append(cand_app.candidate_id)
+        self.rating.append(math.nan if cand_app.rating is None else cand_app.rating)
+        self.buzzword_count.append(cand_app.buzzword_count)
+        for column in flag_columns:
+            self.flags[column].append(bool(getattr(cand_app, column)))
+        for column in string_columns:
+            self.strings[column].append(getattr(cand_app, column))
+        for column in answer_columns:
+            answer = getattr(cand_app, column)
+            offset, size = self.answer_store.put(answer) if answer is not None else (-1, 0)
+            self.answer_offsets.append(offset)
+            self.answer_sizes.append(size)
+            self.answer_lengths.append(len(answer or ""))
+
+    def get_answers(self, i: int) -> list[Optional[str]]:
+        answers = []
+        for j in range(i * len(answer_columns), (i + 1) * len(answer_columns)):
+            offset = self.answer_offsets[j]
+            answers.append(self.answer_store.get(offset, self.answer_sizes[j]) if offset >= 0 else None)
+        return answers
+
+    def get(self, i: int) -> CandidateApplication:
+        """Rebuild the full candidate application at position `i`, reading its answers from disk."""
+        rating = self.rating[i]
+        return CandidateApplication(
+            candidate_id=self.candidate_id[i],
+            rating=None if math.isnan(rating) else rating,
+            buzzword_count=self.buzzword_count[i],
+            **{column: bool(self.flags[column][i]) for column in flag_columns},
+            **{column: self.strings[column][i] for column in string_columns},
+            **dict(zip(answer_columns, self.get_answers(i))))
+
+    def get_features(self) -> dict[str, np.ndarray]:
+        """Feature columns of all candidates, for `scoring.compute_ratings`."""
+        features = {column: np.array(self.flags[column], dtype=bool) for column in flag_columns}
+        features["buzzword_count"] = np.array(self.buzzword_count, dtype=np.int64)
+        features["answer_lengths"] = np.array(self.answer_lengths, dtype=np.int64).reshape(len(self), len(answer_columns))
+        return features
+
+    def rate(self, weights: Optional[RatingWeights] = None) -> None:
+        """Rate all candidates again, e.g. with different weights."""
+        self.rating = array("d", compute_ratings(self.get_features(), weights))
+
+    def get_ranking(self) -> np.ndarray:
+        """Positions of the candidates from the highest to the lowest rating. Candidates without a rating come last."""
+        ratings = np.array(self.rating)
+        # Sorted on the negated ratings, as reversing an ascending sort would also reverse the order of tied candidates.
+        return np.argsort(-np.where(np.isnan(ratings), -np.inf, ratings), kind="stable")
+
+    def close(self) -> None:
+        self.answer_store.close()
+
+
+def load_candidate_archive(results_path: str, answers_filepath: str, batch_size: int = 1000) -> CandidateArchive:
+    """Load candidate applications from a parquet file or dataset written by `columnar_output`, one batch at a time,
+    so that all the answer texts are never in memory at once.
+    """
+    import pyarrow.dataset as ds
+
+    archive = CandidateArchive(answers_filepath)
+    field_names = list(CandidateApplication.__dataclass_fields__)
+    for batch in ds.dataset(results_path, format="parquet").to_batches(columns=field_names, batch_size=batch_size):
+        for record in batch.to_pylist():
+            archive.append(CandidateApplication(**record))
+    return archive
@@ -0,0 +1,97 @@
+# %% Persisted state of processed candidates, for incremental runs
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Optional
+
+from file_processing import CandidateFile
+from pdf_processing import EXTRACTOR_VERSION, get_extraction_options
+
+DEFAULT_STORE_FILENAME = "_candidate_applications.sqlite"
+# Candidates that had processing errors, e.g. an extraction timeout, are processed again by the next runs even if their files didn't
+# change, up to this number of attempts in total, as errors that don't go away, e.g. a corrupt pdf, would be retried on every run.
+MAX_PROCESSING_ATTEMPTS = 3
+
+
+def get_files_signature(files: list[CandidateFile]) -> str:
+    """Signature of a candidate's files, which changes when any file is added, removed or modified, or when the extraction process
+    or the extraction options of this process that change the extracted text (pdf backend, OCR preprocessing) change.
+    """
+    options = get_extraction_options()
+    sha = hashlib.sha256(f"extractor_version={EXTRACTOR_VERSION}\0pdf_backend={options['pdf_backend']}"
+                         f"\0ocr_preprocessing={options['ocr_preprocessing']}".encode("utf-8"))
+    for file in sorted(files, key=lambda f: f.path):
+        sha.update(f"\0{file.path}\0{file.size}\0{file.mtime_ns}".encode("utf-8"))
+    return sha.hexdigest()
+
+
+class CandidateStore:
+    """SQLite store of processed candidate applications, keyed by candidate ID, together with the signature of the files they were processed from.
+    Records are stored as json dictionaries of the `CandidateApplication` fields, with the number of attempts that failed in a row with these files.
+    Args:
+        db_path (str): Path of the SQLite database file. Created if missing.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS candidates (
+                candidate_id INTEGER PRIMARY KEY,
+                files_signature TEXT NOT NULL,
+                record TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                failed_attempts INTEGER NOT NULL DEFAULT 0
+            )""")
+        # Stores created before failed attempts were counted.
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(candidates)")]
+        if "failed_attempts" not in columns:
+            self._conn.execute("ALTER TABLE candidates ADD COLUMN failed_attempts INTEGER NOT NULL DEFAULT 0")
+        self._conn.commit()
+
+    def __enter__(self) -> "CandidateStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get_signatures(self) -> dict[int, str]:
+        return dict(self._conn.execute("SELECT candidate_id, files_signature FROM candidates"))
+
+    def get_retry_ids(self) -> set[int]:
+        """IDs of the candidates stored with processing errors, to process again even if their files didn't change, see MAX_PROCESSING_ATTEMPTS."""
+        return {candidate_id for candidate_id, in self._conn.execute(
+            "SELECT candidate_id FROM candidates WHERE failed_attempts > 0 AND failed_attempts < ?", (MAX_PROCESSING_ATTEMPTS,))}
+
+    def is_up_to_date(self, candidate_id: int, files_signature: str) -> bool:
+        """True if the candidate was processed from these files and isn't to be retried."""
+        return self.get_signature(candidate_id) == files_signature and candidate_id not in self.get_retry_ids()
+
+    def get_signature(self, candidate_id: int) -> Optional[str]:
+        row = self._conn.execute("SELECT files_signature FROM candidates WHERE candidate_id = ?", (candidate_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_record(self, candidate_id: int) -> Optional[dict]:
+        row = self._conn.execute("SELECT record FROM candidates WHERE candidate_id = ?", (candidate_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_records(self) -> dict[int, dict]:
+        return {candidate_id: json.loads(record) for candidate_id, record in self._conn.execute("SELECT candidate_id, record FROM candidates")}
+
+    def put(self, candidate_id: int, files_signature: str, record: dict) -> None:
+        """Store the record of a candidate. Records with processing errors count one more failed attempt if the files didn't change."""
+        failed_attempts = 0
+        if record.get("has_processing_errors"):
+            row = self._conn.execute("SELECT files_signature, failed_attempts FROM candidates WHERE candidate_id = ?", (candidate_id,)).fetchone()
+            failed_attempts = (row[1] if row and row[0] == files_signature else 0) + 1
+        self._conn.execute("INSERT OR REPLACE INTO candidates (candidate_id, files_signature, record, updated_at, failed_attempts) VALUES (?, ?, ?, ?, ?)",
+                           (candidate_id, files_signature, json.dumps(record), time.time(), failed_attempts))
+        self._conn.commit()
+
+    def remove(self, candidate_ids: list[int]) -> None:
+        self._conn.executemany("DELETE FROM candidates WHERE candidate_id = ?", [(i,) for i in candidate_ids])
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
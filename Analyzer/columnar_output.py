@@ -0,0 +1,94 @@
+# %% Columnar (Parquet) output of the candidate applications
+import dataclasses
+import os
+import time
+import typing
+from typing import Any, Iterable, Optional
+
+# Column added to the rows appended to a dataset, to tell apart the intake rounds.
+INTAKE_ROUND_COLUMN = "intake_round"
+
+
+def get_schema(record_type: type, intake_round: bool = False):
+    """Arrow schema of a dataclass, with one typed column per field. Optional fields are nullable columns."""
+    import pyarrow as pa
+
+    arrow_types = {int: pa.int64(), float: pa.float64(), bool: pa.bool_(), str: pa.string()}
+    columns = []
+    for name, field_type in typing.get_type_hints(record_type).items():
+        # Optional[X] is Union[X, None]
+        args = [a for a in typing.get_args(field_type) if a is not type(None)]
+        base_type = args[0] if args else field_type
+        columns.append(pa.field(name, arrow_types[base_type], nullable=True))
+    if intake_round:
+        columns.append(pa.field(INTAKE_ROUND_COLUMN, pa.string()))
+    return pa.schema(columns)
+
+
+def to_table(records: Iterable[Any], record_type: type, intake_round: Optional[str] = None):
+    import pyarrow as pa
+
+    rows = [dataclasses.asdict(r) for r in records]
+    if intake_round is not None:
+        for row in rows:
+            row[INTAKE_ROUND_COLUMN] = intake_round
+    return pa.Table.from_pylist(rows, schema=get_schema(record_type, intake_round is not None))
+
+
+def write_table_in_place(records: Iterable[Any], record_type: type, filepath: str) -> None:
+    """Write the records to a Parquet file, replacing it atomically so that readers never see a partial file."""
+    import pyarrow.parquet as pq
+
+    pq.write_table(to_table(records, record_type), f"{filepath}.tmp")
+    os.replace(f"{filepath}.tmp", filepath)
+
+
+class DatasetAppender:
+    """Appends records to a Parquet dataset folder. Each appender writes a new part file, so previous intake rounds are never rewritten.
+    Records can be written in several batches, each stored as a row group, and the part file is complete once the appender is closed.
+    Args:
+        dataset_dir (str): Folder of the dataset. Created if missing.
+        record_type (type): Dataclass of the records.
+        intake_round (str): Value of the `intake_round` column for all the records written.
+    """
+
+    def __init__(self, dataset_dir: str, record_type: type, intake_round: str):
+        import pyarrow.parquet as pq
+
+        os.makedirs(dataset_dir, exist_ok=True)
+        self.record_type = record_type
+        self.intake_round = intake_round
+        self.filepath = os.path.join(dataset_dir, f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.parquet")
+        # Written under a hidden name until closed, as readers of the dataset ignore files starting with ".".
+        self._tmp_filepath = os.path.join(dataset_dir, f".{os.path.basename(self.filepath)}.tmp")
+        self._writer = pq.ParquetWriter(self._tmp_filepath, get_schema(record_type, intake_round=True))
+
+    def __enter__(self) -> "DatasetAppender":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, records: Iterable[Any]) -> None:
+        table = to_table(records, self.record_type, self.intake_round)
+        if table.num_rows > 0:
+            self._writer.write_table(table)
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp_filepath, self.filepath)
+
+
+def read_table(path: str, columns: Optional[list[str]] = None, intake_rounds: Optional[list[str]] = None):
+    """Read a Parquet file or dataset folder written by this module as a `pyarrow.Table`.
+    Args:
+        columns (list[str]): Columns to read. Reading only the columns needed, e.g. without the answers, takes much less memory.
+        intake_rounds (list[str]): Only read the rows of these intake rounds, for datasets.
+    """
+    import pyarrow.parquet as pq
+
+    filters = [(INTAKE_ROUND_COLUMN, "in", intake_rounds)] if intake_rounds else None
+    return pq.read_table(path, columns=columns, filters=filters)
@@ -0,0 +1,142 @@
+# %% Persistent cache for the text extracted from pdf files
+import hashlib
+import json
+import os
+import pathlib
+from typing import Optional
+
+from pdf_processing import EXTRACTOR_VERSION, PdfText
+
+DEFAULT_CACHE_DIR = os.path.join(pathlib.Path.home(), ".cv_analyzer", "extraction_cache")
+DEFAULT_MAX_SIZE_MB = 512
+
+
+def hash_file_content(filepath: str, chunk_size: int = 1024 * 1024) -> str:
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ExtractionCache:
+    """On-disk cache of `PdfText` results, keyed by the content of the pdf file, the extractor version and the extraction settings.
+    Each entry is a json file named `<content hash>-<settings hash>.json`. Entries are touched when read, and the least recently
+    used ones are evicted once the total size of the cache exceeds `max_size_bytes`.
+    Args:
+        cache_dir (str): Folder where the cache entries are stored. Created if missing.
+        max_size_bytes (int): Maximum total size of the cache entries.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_size_bytes: int = DEFAULT_MAX_SIZE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, filepath: str, settings: dict) -> str:
+        settings_str = json.dumps({"extractor_version": EXTRACTOR_VERSION, **settings}, sort_keys=True)
+        settings_hash = hashlib.sha256(settings_str.encode("utf-8")).hexdigest()[:16]
+        return f"{hash_file_content(filepath)}-{settings_hash}"
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[PdfText]:
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                pdf_text = PdfText.from_dict(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+            return None
+
+        try:
+            os.utime(entry_path) # mark as recently used
+        except OSError:
+            pass
+        return pdf_text
+
+    def put(self, key: str, pdf_text: PdfText) -> None:
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pdf_text.to_dict(), f)
+        # Atomic, so that concurrent workers never read a partially written entry.
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def _entries(self) -> list[os.DirEntry]:
+        with os.scandir(self.cache_dir) as it:
+            return [e for e in it if e.is_file() and e.name.endswith(".json")]
+
+    def evict(self) -> int:
+        """Remove the least recently used entries until the cache fits within `max_size_bytes`. Returns the number of entries removed."""
+        entries = []
+        for e in self._entries():
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                continue # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, e.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total_size -= size
+        return removed
+
+    def invalidate(self, filepath: str) -> int:
+        """Remove all the entries of a pdf file, whatever the settings used to extract it. Returns the number of entries removed."""
+        content_hash = hash_file_content(filepath)
+        removed = 0
+        for e in self._entries():
+            if e.name.startswith(f"{content_hash}-"):
+                try:
+                    os.remove(e.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def clear(self) -> int:
+        """Remove all entries. Returns the number of entries removed."""
+        removed = 0
+        for e in self._entries():
+            try:
+                os.remove(e.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def get_size(self) -> tuple[int, int]:
+        """Returns the number of entries and their total size in bytes."""
+        sizes = [e.stat().st_size for e in self._entries()]
+        return len(sizes), sum(sizes)
+
+
+# %%
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the cache of text extracted from pdf files.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Folder of the extraction cache.")
+    parser.add_argument("--clear", action="store_true", help="Remove all cache entries.")
+    parser.add_argument("--invalidate", nargs="+", default=[], metavar="PDF", help="Remove the cache entries of the given pdf files.")
+    args = parser.parse_args()
+
+    cache = ExtractionCache(args.cache_dir)
+    if args.clear:
+        print(f"Removed {cache.clear()} cache entries.")
+    for filepath in args.invalidate:
+        print(f"Removed {cache.invalidate(filepath)} cache entries for file {pathlib.Path(filepath).name}.")
+
+    num_entries, size_bytes = cache.get_size()
+    print(f"Extraction cache at {cache.cache_dir} has {num_entries} entries, {size_bytes / (1024 * 1024):.1f} MB.")
@@ -0,0 +1,197 @@
+# %% Run pdf text extraction in a supervised worker process
+import multiprocessing
+import os
+import pathlib
+import time
+from typing import Optional
+
+from instrumentation import get_metrics, increment
+from pdf_processing import PdfText, get_extraction_cache, get_extraction_options, read_pdf, set_extraction_cache, set_extraction_options
+
+DEFAULT_TIMEOUT_S = 30
+DEFAULT_MEMORY_LIMIT_MB = 2048
+
+
+class ExtractionError(Exception):
+    """Raised when the text of a pdf could not be extracted in the sandbox."""
+
+
+class ExtractionTimeoutError(ExtractionError):
+    pass
+
+
+class ExtractionMemoryError(ExtractionError):
+    pass
+
+
+def _worker_loop(conn, extraction_cache, extraction_options: dict) -> None:
+    """Entry point of the worker process: extract the text of each pdf received through `conn` and send back the result,
+    with the metrics of the extraction.
+    """
+    set_extraction_cache(extraction_cache)
+    set_extraction_options(**extraction_options)
+    metrics = get_metrics()
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+
+        filepath, kwargs = request
+        metrics.reset()
+        try:
+            result = (True, read_pdf(filepath, **kwargs))
+        except Exception as e:
+            # Exceptions raised by native libraries can't always be pickled, so only send their description.
+            result = (False, f"{type(e).__name__} {e.args}")
+        conn.send(result + (metrics.snapshot(),))
+
+
+class ExtractionSandbox:
+    """Extracts the text of pdf files in a separate worker process, which is killed if it exceeds a wall-clock time or memory limit.
+    Unlike a timeout in a thread, this also stops native Tesseract or Poppler calls that are stuck.
+    The worker is started on first use and started again after being killed. Only the limits are pickled, so a sandbox
+    can be handed to other processes, each starting its own worker.
+    Args:
+        timeout_s (float): Maximum time to extract the text of a single pdf, in seconds.
+        memory_limit_mb (int): Maximum memory of the worker and its subprocesses (Tesseract, Poppler), in MB.
+        poll_interval_s (float): How often the worker is checked while extracting.
+    """
+
+    def __init__(self, timeout_s: float = DEFAULT_TIMEOUT_S, memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB, poll_interval_s: float = 0.2):
+        self.timeout_s = timeout_s
+        self.memory_limit_mb = memory_limit_mb
+        self.poll_interval_s = poll_interval_s
+        self._process = None
+        self._conn = None
+        self._owner_pid = None
+
+    def __getstate__(self) -> dict:
+        return {"timeout_s": self.timeout_s, "memory_limit_mb": self.memory_limit_mb, "poll_interval_s": self.poll_interval_s}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def __enter__(self) -> "ExtractionSandbox":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _start(self) -> None:
+        # spawn rather than fork, so that the worker doesn't inherit the threads and open files of this process.
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_worker_loop, args=(child_conn, get_extraction_cache(), get_extraction_options()), daemon=True)
+        self._process.start()
+        self._owner_pid = os.getpid()
+        child_conn.close()
+
+    def _forget_inherited_worker(self) -> None:
+        """A forked process inherits the sandbox of its parent, whose worker it can't manage: start its own worker instead."""
+        if self._process is not None and self._owner_pid != os.getpid():
+            self._process = None
+            self._conn = None
+
+    def _kill(self) -> None:
+        import psutil
+
+        try:
+            worker = psutil.Process(self._process.pid)
+            for child in worker.children(recursive=True):
+                child.kill()
+        except psutil.NoSuchProcess:
+            pass
+        self._process.kill()
+        self._process.join()
+        self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def _get_memory_mb(self) -> float:
+        import psutil
+
+        try:
+            worker = psutil.Process(self._process.pid)
+            processes = [worker] + worker.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0
+
+        rss = 0
+        for p in processes:
+            try:
+                rss += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss / (1024 * 1024)
+
+    def read_pdf(self, filepath: str, **kwargs) -> PdfText:
+        """Extract the text of a pdf in the worker process. `kwargs` are passed to `pdf_processing.read_pdf`.
+        Raises:
+            ExtractionTimeoutError: the extraction took longer than `timeout_s`. The worker is killed.
+            ExtractionMemoryError: the worker used more than `memory_limit_mb`. The worker is killed.
+            ExtractionError: the extraction failed, or the worker died.
+        """
+        self._forget_inherited_worker()
+        if self._process is None or not self._process.is_alive():
+            self._start()
+
+        filename = pathlib.Path(filepath).name
+        self._conn.send((filepath, kwargs))
+        deadline = time.monotonic() + self.timeout_s
+        while not self._conn.poll(self.poll_interval_s):
+            if not self._process.is_alive():
+                self._kill()
+                increment("extraction_crashes")
+                raise ExtractionError(f"Extraction worker died while processing {filename}.")
+            if time.monotonic() > deadline:
+                self._kill()
+                increment("extraction_timeouts")
+                raise ExtractionTimeoutError(f"Extraction of {filename} took longer than {self.timeout_s} s.")
+            if self._get_memory_mb() > self.memory_limit_mb:
+                self._kill()
+                increment("extraction_memory_exceeded")
+                raise ExtractionMemoryError(f"Extraction of {filename} used more than {self.memory_limit_mb} MB.")
+
+        success, result, worker_metrics = self._conn.recv()
+        get_metrics().merge(worker_metrics)
+        if not success:
+            raise ExtractionError(result)
+        return result
+
+    def close(self) -> None:
+        self._forget_inherited_worker()
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+            self._process.join(timeout=5)
+        except (BrokenPipeError, OSError):
+            pass
+        if self._process.is_alive():
+            self._kill()
+        else:
+            self._conn.close()
+            self._process = None
+            self._conn = None
+
+
+_extraction_sandbox: Optional[ExtractionSandbox] = ExtractionSandbox()
+
+
+def set_extraction_sandbox(sandbox: Optional[ExtractionSandbox]) -> None:
+    """Set the sandbox used by `extract_text` in this process. Pass None to extract in this process, without limits."""
+    global _extraction_sandbox
+    if _extraction_sandbox is not None and _extraction_sandbox is not sandbox:
+        _extraction_sandbox.close()
+    _extraction_sandbox = sandbox
+
+
+def get_extraction_sandbox() -> Optional[ExtractionSandbox]:
+    return _extraction_sandbox
+
+
+def extract_text(filepath: str, **kwargs) -> PdfText:
+    """Extract the text of a pdf with `pdf_processing.read_pdf`, in the current sandbox if one is set."""
+    if _extraction_sandbox is None:
+        return read_pdf(filepath, **kwargs)
+    return _extraction_sandbox.read_pdf(filepath, **kwargs)
@@ -1,17 +1,23 @@
 # %% File processing functions
+from dataclasses import asdict, dataclass, field
+import json
 import os
 import pathlib
 import re
+from typing import Optional
 
+from instrumentation import increment, timer
 
-def get_all_pdfs(folder_path: str) -> list[str]:
-    return [os.path.join(dp, f) for dp, dn, filenames in os.walk(folder_path) for f in filenames if os.path.splitext(f)[1] == '.pdf']
+_id_split_pattern = re.compile(r'[\s-]+')
+_name_split_pattern = re.compile(r'[^a-zA-Z]+')
+words_to_exclude_from_name = frozenset(["cv", "resume", "curriculum", "vitae", "application", "cover", "letter", "science", "scientist", "research", "analyst", "engineer", "data", "msc", "degree"])
+cv_terms = ["cv", "resume", "curriculum"]
+
+DEFAULT_INDEX_FILENAME = "_candidate_index.json"
 
 
 def get_id_from_filepath(filepath: str) -> int:
-    import pathlib
-    import re
-    candidate_id_str: str = re.split(r'[\s-]+', pathlib.Path(filepath).stem)[0]
+    candidate_id_str: str = _id_split_pattern.split(pathlib.Path(filepath).stem)[0]
     if str.isdigit(candidate_id_str):
         return int(candidate_id_str)
 
@@ -19,49 +25,164 @@ def get_id_from_filepath(filepath: str) -> int:
 
 
 def get_name_from_filepath(filepath: str) -> str:
-    import pathlib
-    distrinct = set([s for s in re.split(
-        r'[^a-zA-Z]+', pathlib.Path(filepath).stem)])
+    distrinct = set([s for s in _name_split_pattern.split(pathlib.Path(filepath).stem)])
     result = []
-    words_to_exclude = ["cv", "resume", "curriculum", "vitae", "application", "cover", "letter", "science", "scientist", "research", "analyst", "engineer", "data", "msc", "degree"]
     for s in distrinct:
-        if len(s) > 1 and s.lower() not in words_to_exclude:
+        if len(s) > 1 and s.lower() not in words_to_exclude_from_name:
             result.append(s.strip())
 
     return " ".join(result).strip()
 
 
-def get_application_files(folder_path: str) -> dict[int, str]:
-    all_files = get_all_pdfs(folder_path)
+def get_file_role(filepath: str) -> str:
+    """Classify a candidate's file from its name, as "application", "cv" or "other"."""
+    filename = pathlib.Path(filepath).stem.lower()
+    if "application" in filename:
+        return "application"
+    if any(t in filename for t in cv_terms):
+        return "cv"
+    return "other"
+
+
+@dataclass
+class CandidateFile:
+    path: str
+    role: str
+    size: int
+    mtime_ns: int
+
+
+@dataclass
+class CandidateIndex:
+    """Index of all the pdf files under a root folder, built with a single scan of the folder tree.
+    To refresh the index, only the folders whose modification time changed are listed again. Modifying a file in place doesn't change
+    the modification time of its folder, so the files already indexed in the other folders are stat-ed again, unless `stat_files` is False.
+    Args:
+        root (str): Root folder of the index.
+        folders (dict[str, dict]): For each folder, its modification time, its subfolders and its pdf files.
+    """
+    root: str
+    folders: dict[str, dict] = field(default_factory=lambda: {})
+
+    def refresh(self, full: bool = False, stat_files: bool = True) -> None:
+        """Update the index with the changes of the folder tree.
+        Args:
+            full (bool): List all the folders again, even those whose modification time didn't change.
+            stat_files (bool): Stat the indexed files of the folders that aren't listed again, to pick up files modified in place.
+                Faster without, e.g. on network drives, but files modified in place are then missed.
+        """
+        with timer("scan", self.root):
+            self._refresh(full, stat_files)
+
+    def _refresh(self, full: bool, stat_files: bool) -> None:
+        folders: dict[str, dict] = {}
+        to_scan = [self.root]
+        while to_scan:
+            folder = to_scan.pop()
+            try:
+                folder_mtime_ns = os.stat(folder).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            previous = self.folders.get(folder)
+            if not full and previous is not None and previous["mtime_ns"] == folder_mtime_ns:
+                folders[folder] = self._stat_files(previous) if stat_files else previous
+            else:
+                folders[folder] = self._scan_folder(folder, folder_mtime_ns)
+                increment("folders_scanned")
+            to_scan.extend(reversed(folders[folder]["subfolders"]))
+        self.folders = folders
+
+    @staticmethod
+    def _stat_files(folder: dict) -> dict:
+        files: list[dict] = []
+        for f in folder["files"]:
+            try:
+                stat = os.stat(f["path"])
+            except FileNotFoundError:
+                continue # removed since the folder was listed
+            files.append({**f, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+        increment("files_checked", len(folder["files"]))
+        return {**folder, "files": files}
+
+    @staticmethod
+    def _scan_folder(folder: str, folder_mtime_ns: int) -> dict:
+        subfolders: list[str] = []
+        files: list[dict] = []
+        with os.scandir(folder) as it:
+            # sorted, so that the order of the files doesn't depend on the file system
+            for entry in sorted(it, key=lambda e: e.name):
+                if entry.is_dir():
+                    subfolders.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1] == '.pdf':
+                    # On Windows, stat() of an entry returned by scandir doesn't need another call to the file system.
+                    stat = entry.stat()
+                    files.append(asdict(CandidateFile(entry.path, get_file_role(entry.path), stat.st_size, stat.st_mtime_ns)))
+        return {"mtime_ns": folder_mtime_ns, "subfolders": subfolders, "files": files}
+
+    def get_files(self) -> list[CandidateFile]:
+        return [CandidateFile(**f) for folder in self.folders.values() for f in folder["files"]]
+
+    def get_files_per_id(self) -> dict[int, list[CandidateFile]]:
+        res: dict[int, list[CandidateFile]] = {}
+        for file in self.get_files():
+            res.setdefault(get_id_from_filepath(file.path), []).append(file)
+        return res
+
+    def save(self, index_path: str) -> None:
+        with open(f"{index_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    @staticmethod
+    def load(index_path: str) -> "CandidateIndex":
+        with open(index_path, "r", encoding="utf-8") as f:
+            return CandidateIndex(**json.load(f))
+
+
+def build_candidate_index(folder_path: str, index_path: Optional[str] = None, stat_files: bool = True) -> CandidateIndex:
+    """Index all the pdfs under `folder_path`.
+    If `index_path` is given, the index saved there by a previous call is refreshed rather than built from scratch, then saved again,
+    see `CandidateIndex.refresh` for `stat_files`.
+    """
+    index = CandidateIndex(folder_path)
+    if index_path is not None and os.path.exists(index_path):
+        try:
+            index = CandidateIndex.load(index_path)
+        except (json.JSONDecodeError, TypeError, KeyError) as e:
+            print(f"Could not load candidate index {index_path}, rebuilding it. Error: {type(e).__name__} {e.args}")
+        if index.root != folder_path:
+            index = CandidateIndex(folder_path)
+
+    index.refresh(stat_files=stat_files)
+    if index_path is not None:
+        index.save(index_path)
+    return index
+
+
+def get_all_pdfs(folder_path: str, index: Optional[CandidateIndex] = None) -> list[str]:
+    index = index or build_candidate_index(folder_path)
+    return [f.path for f in index.get_files()]
+
+
+def get_application_files(folder_path: str, index: Optional[CandidateIndex] = None) -> dict[int, str]:
+    index = index or build_candidate_index(folder_path)
     res: dict[int, str] = {}
-    for file in all_files:
-        if "application" in file.lower():
+    for file in index.get_files():
+        if file.role == "application":
+            candidate_id = get_id_from_filepath(file.path)
             print(
-                f"Found application for candidate {get_id_from_filepath(file)}")
-            candidate_id = get_id_from_filepath(file)
-            res[candidate_id] = file
+                f"Found application for candidate {candidate_id}")
+            res[candidate_id] = file.path
 
     return res
 
 
-def get_all_ids(folder_path: str) -> list[int]:
-    import glob
-    all_files = get_all_pdfs(folder_path)
-    result: list[int] = []
-    for file in all_files:
-        result.append(get_id_from_filepath(file))
-
-    result = list(set(result))
-    return result
+def get_all_ids(folder_path: str, index: Optional[CandidateIndex] = None) -> list[int]:
+    index = index or build_candidate_index(folder_path)
+    return list(index.get_files_per_id().keys())
 
 
-def get_pdfs_per_id(folder_path: str) -> dict[int, list[str]]:
-    all_files = get_all_pdfs(folder_path)
-    res: dict[int, list[str]] = {}
-    for file in all_files:
-        candidate_id = get_id_from_filepath(file)
-        if candidate_id in res:
-            res[candidate_id].append(file)
-        else:
-            res[candidate_id] = [file]
-    return res
\ No newline at end of file
+def get_pdfs_per_id(folder_path: str, index: Optional[CandidateIndex] = None) -> dict[int, list[str]]:
+    index = index or build_candidate_index(folder_path)
+    return {candidate_id: [f.path for f in files] for candidate_id, files in index.get_files_per_id().items()}
@@ -1,15 +1,14 @@
 # %% Text processing functions
 
-import re
+from functools import lru_cache
 
+from text_processing import KeywordMatcher
 
-def find_terms_in_text(text: str, terms_to_find: list[str] = ["pytorch", "tensorflow", "deep learning"]) -> set[str]:
-    matches: set[str] = set()
 
-    for term in terms_to_find:
-        term = str.lower(term)
-        res_search = re.search(term, str.lower(text))
-        if res_search is not None:
-            matches.add(res_search.string)
+@lru_cache(maxsize=32)
+def _get_matcher(terms: tuple[str, ...]) -> KeywordMatcher:
+    return KeywordMatcher(list(terms))
+
 
-    return matches
\ No newline at end of file
+def find_terms_in_text(text: str, terms_to_find: list[str] = ["pytorch", "tensorflow", "deep learning"]) -> set[str]:
+    return set(_get_matcher(tuple(terms_to_find)).find_all(text))
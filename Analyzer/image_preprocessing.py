@@ -0,0 +1,214 @@
+# %% Preprocessing of page images before OCR, to make Tesseract faster without losing accuracy
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+# Pages are downscaled to this resolution at most.
+TARGET_DPI = 200
+# Pages whose median character height, in pixels, is above MAX_TEXT_HEIGHT_PX are downscaled to TARGET_TEXT_HEIGHT_PX,
+# as Tesseract is most accurate with characters around 20 to 30 pixels high, and slower on larger ones.
+MAX_TEXT_HEIGHT_PX = 40
+TARGET_TEXT_HEIGHT_PX = 25
+# Pages are deskewed when rotated by more than MIN_SKEW_DEG, up to MAX_SKEW_DEG.
+MIN_SKEW_DEG = 0.3
+MAX_SKEW_DEG = 5.0
+SKEW_STEP_DEG = 0.25
+# Pages with less than this fraction of dark pixels, once photos are removed, and without any character, are skipped as blank.
+BLANK_PAGE_MAX_INK = 0.0002
+# Photos are found by tiles of PHOTO_TILE_PX pixels. Tiles of photos are textured, with more than PHOTO_TILE_MIN_SPREAD gray levels
+# between their 5th and 95th percentiles, and continuous-tone, with more than PHOTO_TILE_MIN_MIDTONES of their pixels in the middle half
+# of that range. Text is two-toned instead, on a flat background of any shade, e.g. a tinted scan or a shaded sidebar.
+PHOTO_TILE_PX = 32
+PHOTO_TILE_MIN_SPREAD = 30
+PHOTO_TILE_MIN_MIDTONES = 0.4
+# Aperture of the median filter removing scanning noise before the tiles are measured, in pixels.
+PHOTO_DENOISE_PX = 5
+# Photos are at least PHOTO_MIN_TILES tiles wide and high. Smaller groups of tiles, e.g. logos or dense bold text, are kept.
+PHOTO_MIN_TILES = 3
+# Each pixel is binarized by comparing it with the mean of a neighbourhood of BINARIZE_BLOCK_PX pixels, minus BINARIZE_OFFSET gray levels.
+BINARIZE_BLOCK_PX = 51
+BINARIZE_OFFSET = 15
+
+
+@dataclass
+class PreprocessedPage:
+    """Result of `preprocess_page_image`.
+    Args:
+        image (np.ndarray): Binarized image to OCR, black text on white. None if the page is skipped.
+        dpi (int): Resolution of `image`.
+        skip_reason (str): "blank" or "photo" if the page is skipped, as it has no text to OCR.
+        photo_fraction (float): Fraction of the page covered by photos, which were blanked out.
+        skew_deg (float): Rotation corrected by deskewing, in degrees.
+    """
+    image: Optional[np.ndarray]
+    dpi: int
+    skip_reason: Optional[str] = None
+    photo_fraction: float = 0.0
+    skew_deg: float = 0.0
+
+
+def get_photo_mask(gray: np.ndarray) -> np.ndarray:
+    """Mask of the photo regions of a grayscale page, from the texture of its tiles, see PHOTO_TILE_MIN_SPREAD. Flat regions of any shade
+    and text, whose pixels are either background or ink with mid-gray pixels only on the edges of strokes, aren't photos.
+    Returns a boolean mask with the size of the page.
+    """
+    tile = PHOTO_TILE_PX
+    rows, cols = gray.shape[0] // tile, gray.shape[1] // tile
+    if rows == 0 or cols == 0:
+        return np.zeros(gray.shape, dtype=bool)
+    # The grain of scans is smoothed out first, or flat backgrounds and text would be textured too.
+    smooth = cv2.medianBlur(gray, PHOTO_DENOISE_PX)
+    tiles = smooth[:rows * tile, :cols * tile].reshape(rows, tile, cols, tile).swapaxes(1, 2).reshape(rows, cols, tile * tile)
+    dark, light = np.percentile(tiles, [5, 95], axis=2)
+    quarter = (light - dark) / 4
+    midtones = ((tiles > (dark + quarter)[..., None]) & (tiles < (light - quarter)[..., None])).mean(axis=2)
+    photo_tiles = ((light - dark > PHOTO_TILE_MIN_SPREAD) & (midtones > PHOTO_TILE_MIN_MIDTONES)).astype(np.uint8)
+    # Fill the smoother tiles inside photos, drop the groups of tiles too small to be photos, and cover the edges of photos.
+    photo_tiles = cv2.morphologyEx(photo_tiles, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    photo_tiles = cv2.morphologyEx(photo_tiles, cv2.MORPH_OPEN, np.ones((PHOTO_MIN_TILES, PHOTO_MIN_TILES), np.uint8))
+    photo_tiles = cv2.dilate(photo_tiles, np.ones((3, 3), np.uint8))
+    # Stretched to the size of the page, to also cover the partial tiles on its right and bottom edges.
+    return cv2.resize(photo_tiles, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_NEAREST).astype(bool)
+
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    """Black text on a white background. Each pixel is compared with its neighbourhood, so that text on a tinted background or in a
+    shaded box is kept, where a single threshold for the whole page would turn the shaded region black or white.
+    """
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, BINARIZE_BLOCK_PX, BINARIZE_OFFSET)
+
+
+def get_ink_fraction(binary: np.ndarray) -> float:
+    """Fraction of dark pixels of a binarized page, ignoring isolated specks of scanning noise."""
+    ink = cv2.morphologyEx(255 - binary, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+    return cv2.countNonZero(ink) / ink.size
+
+
+def get_median_text_height(binary: np.ndarray) -> Optional[float]:
+    """Median height in pixels of the connected components that look like characters, or None if there are none."""
+    _, _, stats, _ = cv2.connectedComponentsWithStats(255 - binary, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    is_character = (heights >= 4) & (heights <= binary.shape[0] // 10) & (widths <= 3 * heights)
+    if not is_character.any():
+        return None
+    return float(np.median(heights[is_character]))
+
+
+def get_skew_angle(binary: np.ndarray) -> float:
+    """Rotation of the text lines of a binarized page, in degrees, found as the angle that best aligns the rows of ink (projection profile)."""
+    # A small image is enough to find the angle, and much faster to rotate.
+    scale = min(1.0, 800 / binary.shape[1])
+    ink = cv2.resize(255 - binary, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    center = (ink.shape[1] / 2, ink.shape[0] / 2)
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_SKEW_DEG, MAX_SKEW_DEG + SKEW_STEP_DEG / 2, SKEW_STEP_DEG):
+        rotated = cv2.warpAffine(ink, cv2.getRotationMatrix2D(center, angle, 1.0), (ink.shape[1], ink.shape[0]), flags=cv2.INTER_NEAREST)
+        score = float(np.var(rotated.sum(axis=1, dtype=np.float64)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def rotate(image: np.ndarray, angle_deg: float) -> np.ndarray:
+    center = (image.shape[1] / 2, image.shape[0] / 2)
+    return cv2.warpAffine(image, cv2.getRotationMatrix2D(center, angle_deg, 1.0), (image.shape[1], image.shape[0]),
+                          flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+
+def preprocess_page_image(gray: np.ndarray, dpi: int) -> PreprocessedPage:
+    """Prepare a grayscale page image rendered at `dpi` for OCR: blank out photos, skip pages without text, downscale pages with
+    large text or a resolution over TARGET_DPI, binarize and deskew. Tesseract binarizes images itself, but binarized and smaller
+    images are OCRed faster. Pages are only skipped when they have no character-sized marks left, as text lost here can't be recovered.
+    """
+    photo_mask = get_photo_mask(gray)
+    photo_fraction = float(photo_mask.mean())
+    if photo_fraction > 0:
+        gray = gray.copy()
+        gray[photo_mask] = 255
+
+    binary = binarize(gray)
+    text_height = get_median_text_height(binary)
+    if text_height is None and get_ink_fraction(binary) < BLANK_PAGE_MAX_INK:
+        return PreprocessedPage(None, dpi, "photo" if photo_fraction > 0 else "blank", photo_fraction)
+
+    scale = min(1.0, TARGET_DPI / dpi)
+    if text_height is not None and text_height * scale > MAX_TEXT_HEIGHT_PX:
+        scale = TARGET_TEXT_HEIGHT_PX / text_height
+    if scale < 1.0:
+        # Downscale the grayscale image and binarize again, which keeps thin strokes better than downscaling the binary image.
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        binary = binarize(gray)
+        dpi = max(int(dpi * scale), 1)
+
+    skew_deg = get_skew_angle(binary)
+    if abs(skew_deg) >= MIN_SKEW_DEG:
+        # Only the edges of the strokes are gray once rotated.
+        _, binary = cv2.threshold(rotate(binary, skew_deg), 127, 255, cv2.THRESH_BINARY)
+    return PreprocessedPage(binary, dpi, None, photo_fraction, skew_deg)
+
+
+def compare_ocr(gray: np.ndarray, dpi: int) -> dict:
+    """OCR a page image with and without preprocessing. Returns the time and mean confidence of both, to weigh the time saved by
+    preprocessing against the confidence lost.
+    """
+    import time
+    import pytesseract
+    from pdf_processing import parse_ocr_data
+
+    start = time.perf_counter()
+    raw_conf, _ = parse_ocr_data(pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT))
+    raw_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    page = preprocess_page_image(gray, dpi)
+    preprocess_s = time.perf_counter() - start
+    conf = float("nan")
+    if page.image is not None:
+        conf, _ = parse_ocr_data(pytesseract.image_to_data(page.image, config=f"--dpi {page.dpi}", output_type=pytesseract.Output.DICT))
+    total_s = time.perf_counter() - start
+
+    return {"raw_s": raw_s, "raw_confidence": raw_conf, "preprocess_s": preprocess_s, "preprocessed_s": total_s,
+            "preprocessed_confidence": conf, "skip_reason": page.skip_reason}
+
+
+# %%
+
+if __name__ == "__main__":
+    import argparse
+    import math
+    import pathlib
+
+    parser = argparse.ArgumentParser(description="Compare the time and confidence of OCR with and without preprocessing, on the pages of pdfs.")
+    parser.add_argument("pdfs", nargs="+", help="Pdf files whose pages are OCRed.")
+    parser.add_argument("--dpi", type=int, default=200, help="Resolution at which pages are rendered.")
+    parser.add_argument("--tesseract", default=None, help="Path of the Tesseract executable, if not on the PATH.")
+    parser.add_argument("--poppler", default=None, help="Path of the Poppler bin folder, if not on the PATH.")
+    args = parser.parse_args()
+
+    import pytesseract
+    from pdf2image import convert_from_path
+    if args.tesseract:
+        pytesseract.pytesseract.tesseract_cmd = args.tesseract
+
+    results = []
+    for pdf in args.pdfs:
+        for i, page_image in enumerate(convert_from_path(pdf, dpi=args.dpi, grayscale=True, poppler_path=args.poppler)):
+            result = compare_ocr(np.array(page_image), args.dpi)
+            results.append(result)
+            print(f"{pathlib.Path(pdf).name} page {i + 1}: {result['raw_s']:.2f} s, confidence {result['raw_confidence']:.1f} without preprocessing, "
+                  f"{result['preprocessed_s']:.2f} s, confidence {result['preprocessed_confidence']:.1f} with preprocessing"
+                  + (f" (skipped as {result['skip_reason']})" if result["skip_reason"] else ""))
+
+    if results:
+        raw_s = sum(r["raw_s"] for r in results)
+        preprocessed_s = sum(r["preprocessed_s"] for r in results)
+        # Confidences of pages with text in both runs only.
+        both = [r for r in results if not math.isnan(r["raw_confidence"]) and not math.isnan(r["preprocessed_confidence"])]
+        print(f"{len(results)} pages: {raw_s:.1f} s without preprocessing, {preprocessed_s:.1f} s with preprocessing "
+              f"({1 - preprocessed_s / raw_s:.0%} saved).")
+        if both:
+            confidence_change = sum(r["preprocessed_confidence"] - r["raw_confidence"] for r in both) / len(both)
+            print(f"Mean confidence change on the {len(both)} pages OCRed both ways: {confidence_change:+.2f}.")
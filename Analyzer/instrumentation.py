@@ -0,0 +1,136 @@
+# %% Timers and counters of the stages of the pipeline, to see where the time goes and which files are slow
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+import heapq
+import json
+import re
+import threading
+import time
+from typing import Iterator, Optional
+
+# Number of slowest calls kept for each stage, with the file they processed.
+SLOWEST_COUNT = 10
+METRICS_PREFIX = "cv_analyzer"
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+    slowest: list[tuple[float, str]] = field(default_factory=list) # min-heap of (duration, label)
+
+    def add(self, duration_s: float, label: Optional[str] = None) -> None:
+        self.count += 1
+        self.total_s += duration_s
+        self.max_s = max(self.max_s, duration_s)
+        if label is not None:
+            if len(self.slowest) < SLOWEST_COUNT:
+                heapq.heappush(self.slowest, (duration_s, label))
+            else:
+                heapq.heappushpop(self.slowest, (duration_s, label))
+
+    def merge(self, other: "StageStats") -> None:
+        self.count += other.count
+        self.total_s += other.total_s
+        self.max_s = max(self.max_s, other.max_s)
+        self.slowest = heapq.nlargest(SLOWEST_COUNT, self.slowest + other.slowest)
+        heapq.heapify(self.slowest)
+
+
+class Metrics:
+    """Timers and counters of the stages of a run. Thread safe, as pages are OCRed in threads.
+    Each process has its own metrics: worker processes send a `snapshot` of theirs, which is merged into the metrics of the main process.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, StageStats] = {}
+        self.counters: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage: str, label: Optional[str] = None) -> Iterator[None]:
+        """Time the code run in the context as a call of `stage`. `label`, e.g. the file being processed, identifies the slowest calls."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_duration(stage, time.perf_counter() - start, label)
+
+    def add_duration(self, stage: str, duration_s: float, label: Optional[str] = None) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, StageStats()).add(duration_s, label)
+
+    def increment(self, counter: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def snapshot(self) -> dict:
+        """The metrics as a dictionary that can be pickled, sent to another process and merged, or dumped to json."""
+        with self._lock:
+            return {"stages": {stage: asdict(stats) for stage, stats in self.stages.items()}, "counters": dict(self.counters)}
+
+    def merge(self, snapshot: dict) -> None:
+        with self._lock:
+            for stage, stats in snapshot["stages"].items():
+                other = StageStats(stats["count"], stats["total_s"], stats["max_s"], [tuple(s) for s in stats["slowest"]])
+                self.stages.setdefault(stage, StageStats()).merge(other)
+            for counter, value in snapshot["counters"].items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=4)
+
+    def to_prometheus_text(self) -> str:
+        """The metrics in the Prometheus text exposition format, e.g. for the node exporter's textfile collector."""
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {METRICS_PREFIX}_stage_seconds summary"]
+        for stage, stats in snapshot["stages"].items():
+            lines.append(f'{METRICS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {stats["total_s"]}')
+            lines.append(f'{METRICS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append(f"# TYPE {METRICS_PREFIX}_stage_max_seconds gauge")
+        for stage, stats in snapshot["stages"].items():
+            lines.append(f'{METRICS_PREFIX}_stage_max_seconds{{stage="{stage}"}} {stats["max_s"]}')
+        for counter, value in snapshot["counters"].items():
+            name = f"{METRICS_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', counter)}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def print_summary(self) -> None:
+        snapshot = self.snapshot()
+        print("Time per stage:")
+        for stage, stats in sorted(snapshot["stages"].items(), key=lambda item: item[1]["total_s"], reverse=True):
+            mean_ms = stats["total_s"] / stats["count"] * 1000 if stats["count"] else 0
+            print(f"\t{stage:<18} {stats['total_s']:10.2f} s total, {stats['count']:7} calls, {mean_ms:9.1f} ms mean, {stats['max_s'] * 1000:9.1f} ms max")
+            for duration_s, label in sorted(stats["slowest"], reverse=True)[:3]:
+                print(f"\t\t{duration_s:8.2f} s  {label}")
+        counters = snapshot["counters"]
+        if counters:
+            print("Counters:")
+            for counter, value in sorted(counters.items()):
+                print(f"\t{counter:<18} {value:g}")
+        if counters.get("ocr_pages_with_text"):
+            print(f"Mean OCR confidence: {counters['ocr_confidence_sum'] / counters['ocr_pages_with_text']:.1f}")
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Metrics of this process."""
+    return _metrics
+
+
+def timer(stage: str, label: Optional[str] = None):
+    """Time a stage in the metrics of this process, see `Metrics.timer`."""
+    return _metrics.timer(stage, label)
+
+
+def increment(counter: str, value: float = 1) -> None:
+    _metrics.increment(counter, value)
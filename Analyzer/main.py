@@ -1,20 +1,37 @@
 # %%
-from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 import pathlib
 import os
-from typing import Optional
+import time
+from typing import TYPE_CHECKING, Iterator, Optional
 
 from rich.progress import track
-from file_processing import get_name_from_filepath
-from pdf_processing import PdfText, read_pdf
+from instrumentation import get_metrics, increment, timer
+from file_processing import CandidateIndex, build_candidate_index, get_file_role, get_name_from_filepath
+from pdf_processing import PdfText, get_extraction_cache, get_extraction_options, set_extraction_cache, set_extraction_options
+from pdf_backends import DEFAULT_PDF_BACKEND, pdf_backends
+from extraction_sandbox import extract_text, get_extraction_sandbox, set_extraction_sandbox
 from text_processing import get_answers_from_text
-from text_processing import count_buzzwords
+from text_processing import count_buzzwords, find_keywords
+from scoring import rate_candidate_applications
 from file_processing import get_pdfs_per_id
 
+if TYPE_CHECKING:
+    from candidate_store import CandidateStore
 
-@dataclass
+# Output file of incremental runs, updated in place, with the extension of the output format.
+OUTPUT_FILENAME = "_candidate_applications"
+# Parquet dataset folder to which each non-incremental run appends its results.
+OUTPUT_DATASET_FOLDERNAME = "_candidate_applications_rounds"
+# Number of candidate applications written at once to parquet outputs while streaming, stored as a row group.
+OUTPUT_BATCH_SIZE = 100
+
+
+@dataclass(slots=True)
 class CandidateApplication:
+    """Processed application of a candidate. Uses slots, without a per-instance `__dict__`, to keep many candidates in memory.
+    See `candidate_archive.CandidateArchive` to rank large archives of candidates, with the answers kept on disk.
+    """
     candidate_id: int = 0
     fullname: Optional[str] = ""
     rating: Optional[float] = None
@@ -34,39 +51,24 @@ class CandidateApplication:
     buzzword_count: int = 0
     has_processing_errors: bool = False
 
-    def set_nice_to_haves(self, text : str):
-        text_lower = text.lower()
+    def set_nice_to_haves(self, text : str, keyword_hits: Optional[dict[str, list[int]]] = None):
+        """Set the mentions of nice-to-have skills found in `text`.
+        `keyword_hits` is the result of `find_keywords` for `text`, to avoid scanning the text again.
+        """
+        if keyword_hits is None:
+            keyword_hits = find_keywords(text)
 
-        self.mentions_pytorch |= "pytorch" in text_lower
-        self.mentions_tensorflow |= "tensorflow" in text_lower
-        self.mentions_csharp |= "c#" in text_lower
-        self.mentions_computervision |= "computer vision" in text_lower
-        self.mentions_azure |= "azure" in text_lower
-        self.mentions_aws |= "aws" in text_lower
+        self.mentions_pytorch |= "pytorch" in keyword_hits
+        self.mentions_tensorflow |= "tensorflow" in keyword_hits
+        self.mentions_csharp |= "c#" in keyword_hits
+        self.mentions_computervision |= "computer vision" in keyword_hits
+        self.mentions_azure |= "azure" in keyword_hits
+        self.mentions_aws |= "aws" in keyword_hits
 
     def get_all_answers(self) -> list[str]:
         answers = [self.answer1, self.answer2, self.answer3, self.answer4, self.answer5]
         return [a for a in answers if a is not None]
 
-    def set_rating(self):
-        """Set the rating of the candidate application, based on the mentions of nice-to-have skills and the buzzword count.
-        Necessary to correctly serialize dataclass, can't use @property decorator. Must be called before serializing.
-        """
-        if self.has_processing_errors:
-            return
-
-        self.rating = self.mentions_computervision + self.mentions_csharp / 2 + self.mentions_pytorch + self.mentions_tensorflow / 2
-        self.rating += self.mentions_azure + self.mentions_aws / 1.1
-        self.rating -= (self.buzzword_count / 1.75)
-
-        for answer in self.get_all_answers():
-            if len(answer) > 0 and len(answer) < 30:
-                self.rating -= 1 # candidate attempted response but answer is very short. Sometimes indicates link to another document, which is invalid.
-            elif len(answer) > 30 and len(answer) < 250:
-                self.rating -= 0.5 # candidate attempted response but answer is too short.
-            elif len(answer) > 1800:
-                self.rating -= 0.5 # candidate provided a too long answer
-
     def set_data_from_cv(self, cv_filepath : str):
         if self is None or cv_filepath is None:
             return
@@ -77,115 +79,359 @@ class CandidateApplication:
         self.fullname = candidate_name
 
         print(f"\tFound CV for candidate {self.candidate_id}, whose name is {candidate_name}.")
-        cv_text : PdfText = read_pdf(self.cv_filepath)
+        with timer("extract", pathlib.Path(self.cv_filepath).name):
+            cv_text : PdfText = extract_text(self.cv_filepath)
 
         all_cv_text = cv_text.get_all_text()
+        with timer("find_keywords"):
+            keyword_hits = find_keywords(all_cv_text)
 
-        # Set nice-to-have skills from the cv
-        self.set_nice_to_haves(all_cv_text)
+            # Set nice-to-have skills from the cv
+            self.set_nice_to_haves(all_cv_text, keyword_hits)
 
-        # Check for buzzwords in the cv
-        self.buzzword_count += count_buzzwords(all_cv_text)
+            # Check for buzzwords in the cv
+            self.buzzword_count += count_buzzwords(all_cv_text, keyword_hits)
 
 
 # %%
-def get_all_candidate_applications(folder_path: str) -> list[CandidateApplication]:
-    pdfs_per_id = get_pdfs_per_id(folder_path)
-    print(f"Found {len(pdfs_per_id)} candidates with applications.")
-    
-    result_dict: defaultdict[int, CandidateApplication] = defaultdict(CandidateApplication)
+def process_candidate(candidate_id: int, pdfs_paths: list[str]) -> CandidateApplication:
+    """Extract and parse all the pdfs submitted by a single candidate.
+    Defined at module level so that it can be sent to worker processes when processing candidates in parallel.
+    """
+    print(f"Candidate {candidate_id} has {len(pdfs_paths)} pdfs.")
+    start = time.perf_counter()
+    cand_app = CandidateApplication(candidate_id=candidate_id)
 
-    for candidate_id, pdfs_paths in track(pdfs_per_id.items()):
-        print(f"Candidate {candidate_id} has {len(pdfs_paths)} pdfs.")
-        cand_app: CandidateApplication = result_dict[candidate_id]
-        cand_app.candidate_id = candidate_id
+    for pdf_path in pdfs_paths:
+        file_role : str = get_file_role(pdf_path)
+        try:
+            if file_role == "application":
+                print(f"\tFound application for candidate {candidate_id}")
+                cand_app.application_filepath = pdf_path
+                with timer("extract", pathlib.Path(pdf_path).name):
+                    application_text : PdfText = extract_text(pdf_path)
+
+                if not application_text:
+                    cand_app.has_processing_errors = True
+                    continue
+                
+                all_application_text = application_text.get_all_text()
+                with timer("find_keywords"):
+                    keyword_hits = find_keywords(all_application_text)
 
-        for pdf_path in pdfs_paths:
-            filename : str = pathlib.Path(pdf_path).stem
-            try:
-                if "application" in filename.lower():
-                    print(f"\tFound application for candidate {candidate_id}")
-                    cand_app.application_filepath = pdf_path
-                    application_text : PdfText = read_pdf(pdf_path)
-
-                    if not application_text:
-                        cand_app.has_processing_errors = True
-                        continue
-                    
-                    all_application_text = application_text.get_all_text()
-                    
                     # Set nice-to-have skills in the application
-                    cand_app.set_nice_to_haves(all_application_text)
-                    
+                    cand_app.set_nice_to_haves(all_application_text, keyword_hits)
+
                     # Check for buzzwords in the application
-                    cand_app.buzzword_count += count_buzzwords(all_application_text)
-                    
+                    cand_app.buzzword_count += count_buzzwords(all_application_text, keyword_hits)
+                
+                with timer("parse_answers", pathlib.Path(pdf_path).name):
                     answers = get_answers_from_text(application_text.get_all_text())
-                    if not answers:
-                        cand_app.has_processing_errors = True
-                        continue
-                        
-                    cand_app.answer1 = answers[1]
-                    cand_app.answer2 = answers[2]
-                    cand_app.answer3 = answers[3]
-                    cand_app.answer4 = answers[4]
-                    cand_app.answer5 = answers[5]
+                if not answers:
+                    cand_app.has_processing_errors = True
+                    continue
                     
-                elif "cv" in filename.lower() or "resume" in filename.lower() or "curriculum" in filename.lower():
-                    cand_app.set_data_from_cv(pdf_path)
+                cand_app.answer1 = answers[1]
+                cand_app.answer2 = answers[2]
+                cand_app.answer3 = answers[3]
+                cand_app.answer4 = answers[4]
+                cand_app.answer5 = answers[5]
+                
+            elif file_role == "cv":
+                cand_app.set_data_from_cv(pdf_path)
+
+        except Exception as e:
+            print(f"Error processing file {pathlib.Path(pdf_path).name}. Error: {type(e).__name__} {e.args}")
+            if (cand_app):
+                cand_app.has_processing_errors = True
+
+    # Final processing
+    # If no CV was found, try searching with different terms.
+    alternative_cv_terms = ["scientist", "research", "curriculum", "analyst", "engineer", "science"]
+    if cand_app.cv_filepath is None:
+        possible_cv_files = [f for f in pdfs_paths if any(t for t in alternative_cv_terms if t in pathlib.Path(f).stem.lower())]
+        if len(possible_cv_files) == 1:
+            try:
+                cand_app.set_data_from_cv(possible_cv_files[0])
 
             except Exception as e:
-                print(f"Error processing file {pathlib.Path(pdf_path).name}. Error: {type(e).__name__} {e.args}")
+                print(f"Error processing file {pathlib.Path(possible_cv_files[0]).name}. Error: {type(e).__name__} {e.args}")
                 if (cand_app):
                     cand_app.has_processing_errors = True
-                    
 
-        # Final processing
-        for cand_app in result_dict.values():
-            # If no CV was found, try searching with different terms.
-            alternative_cv_terms = ["scientist", "research", "curriculum", "analyst", "engineer", "science"]
-            if cand_app.cv_filepath is None:
-                possible_cv_files = [f for f in pdfs_per_id[cand_app.candidate_id] if any(t for t in alternative_cv_terms if t in pathlib.Path(f).stem.lower())]
-                if len(possible_cv_files) == 1:
-                    try:
-                        cand_app.set_data_from_cv(possible_cv_files[0])
-
-                    except Exception as e:
-                        print(f"Error processing file {pathlib.Path(possible_cv_files[0]).name}. Error: {type(e).__name__} {e.args}")
-                        if (cand_app):
-                            cand_app.has_processing_errors = True
-                        continue
-                    
-            if cand_app.cv_filepath == "" and cand_app.application_filepath == "":
-                print(f"Could not find application or CV for candidate {cand_app.candidate_id}.")
-                cand_app.has_processing_errors = True
-            
-            cand_app.set_rating() # necessary to serialize dataclass, can't use @property decorator.
-    
-    print(f"Processed {len(result_dict)} candidate applications.")
-    return list(result_dict.values())
+    if cand_app.cv_filepath == "" and cand_app.application_filepath == "":
+        print(f"Could not find application or CV for candidate {cand_app.candidate_id}.")
+        cand_app.has_processing_errors = True
+    if cand_app.has_processing_errors:
+        increment("candidates_with_errors")
+    get_metrics().add_duration("candidate", time.perf_counter() - start, str(candidate_id))
+
+    # Not rated here: candidates are rated by the process that collects them, with its rating weights, see `scoring.rate_candidate_applications`.
+    return cand_app
+
+
+def init_worker(extraction_cache, extraction_sandbox, extraction_options: dict) -> None:
+    set_extraction_cache(extraction_cache)
+    set_extraction_sandbox(extraction_sandbox)
+    set_extraction_options(**extraction_options)
+
+
+def process_candidate_in_worker(candidate_id: int, pdfs_paths: list[str]) -> tuple[CandidateApplication, dict]:
+    """Same as `process_candidate`, also returning the metrics of processing the candidate, to merge them into the main process' metrics."""
+    metrics = get_metrics()
+    metrics.reset()
+    cand_app = process_candidate(candidate_id, pdfs_paths)
+    return cand_app, metrics.snapshot()
+
+
+def iter_processed_candidates(pdfs_per_id: dict[int, list[str]], max_workers: int = 1) -> Iterator[CandidateApplication]:
+    """Extract and parse the pdfs of each candidate, yielding each candidate application as soon as it is processed.
+    With `max_workers` > 1, each candidate is processed in a separate worker process, so that PDF extraction and OCR run concurrently,
+    and candidates are yielded in the order in which the workers complete.
+    """
+    if max_workers <= 1:
+        for candidate_id, pdfs_paths in track(pdfs_per_id.items()):
+            yield process_candidate(candidate_id, pdfs_paths)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # Workers don't share this process' state, so hand them the extraction cache and sandbox explicitly.
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                             initargs=(get_extraction_cache(), get_extraction_sandbox(), get_extraction_options())) as executor:
+        futures = {executor.submit(process_candidate_in_worker, candidate_id, pdfs_paths): candidate_id
+                   for candidate_id, pdfs_paths in pdfs_per_id.items()}
+        try:
+            # Advance the progress bar as each candidate completes, in whichever worker it ran.
+            for future in track(as_completed(futures), total=len(futures)):
+                candidate_id = futures[future]
+                try:
+                    cand_app, worker_metrics = future.result()
+                    get_metrics().merge(worker_metrics)
+                except Exception as e:
+                    # Only reached if the worker itself died (e.g. a crash in native code), as file errors are handled in process_candidate.
+                    print(f"Error processing candidate {candidate_id}. Error: {type(e).__name__} {e.args}")
+                    increment("worker_crashes")
+                    cand_app = CandidateApplication(candidate_id=candidate_id, has_processing_errors=True)
+                yield cand_app
+        finally:
+            # If the caller stops early, don't process the remaining candidates.
+            for future in futures:
+                future.cancel()
+
+
+def iter_candidate_applications(folder_path: str, max_workers: int = 1, store: Optional["CandidateStore"] = None,
+                                index: Optional[CandidateIndex] = None) -> Iterator[CandidateApplication]:
+    """Process all the candidate applications found in `folder_path`, yielding each one as soon as it is finished, so that the output
+    can be written progressively. The candidates are discovered, their pdfs are extracted and parsed, and they are rated in this process,
+    with its rating weights, once each. Unchanged candidates loaded from `store` are yielded first, then the others as they complete.
+    See `get_all_candidate_applications` for the arguments.
+    """
+    index = index or build_candidate_index(folder_path)
+    pdfs_per_id = get_pdfs_per_id(folder_path, index)
+    print(f"Found {len(pdfs_per_id)} candidates with applications.")
+
+    pdfs_to_process = pdfs_per_id
+    if store is not None:
+        from candidate_store import get_files_signature
+
+        signatures = {candidate_id: get_files_signature(files) for candidate_id, files in index.get_files_per_id().items()}
+        stored_signatures = store.get_signatures()
+        retry_ids = store.get_retry_ids()
+        pdfs_to_process = {candidate_id: pdfs_paths for candidate_id, pdfs_paths in pdfs_per_id.items()
+                           if stored_signatures.get(candidate_id) != signatures[candidate_id] or candidate_id in retry_ids}
+        store.remove([candidate_id for candidate_id in stored_signatures if candidate_id not in pdfs_per_id])
+        print(f"{len(pdfs_to_process)} candidates have new or changed files or had processing errors, "
+              f"{len(pdfs_per_id) - len(pdfs_to_process)} are unchanged.")
+
+        unchanged_apps = [CandidateApplication(**record) for candidate_id, record in store.get_records().items()
+                          if candidate_id in pdfs_per_id and candidate_id not in pdfs_to_process]
+        # Rate again, as the rating weights may differ from when the candidates were stored.
+        with timer("score"):
+            rate_candidate_applications(unchanged_apps)
+        yield from unchanged_apps
+
+    processed_count = 0
+    for cand_app in iter_processed_candidates(pdfs_to_process, max_workers):
+        # Rated as soon as processed, so that it can be written straight away.
+        with timer("score"):
+            rate_candidate_applications([cand_app])
+        if store is not None:
+            # Stored as soon as processed, so that an interrupted run doesn't process the candidate again.
+            store.put(cand_app.candidate_id, signatures[cand_app.candidate_id], asdict(cand_app))
+        processed_count += 1
+        yield cand_app
+    print(f"Processed {processed_count} candidate applications.")
+
+
+def get_all_candidate_applications(folder_path: str, max_workers: int = 1, store: Optional["CandidateStore"] = None,
+                                   index: Optional[CandidateIndex] = None) -> list[CandidateApplication]:
+    """Process all the candidate applications found in `folder_path`, and return them in the order in which they were found.
+    Args:
+        folder_path (str): Root folder containing the pdfs of all candidates.
+        max_workers (int): Number of worker processes. With 1 (default) candidates are processed serially in this process.
+        store (CandidateStore): If given, only the candidates whose files changed since they were stored are processed,
+            the others are loaded from the store. The store is updated with the processed candidates.
+        index (CandidateIndex): Up-to-date index of `folder_path`. If not given, the folder is scanned.
+    """
+    index = index or build_candidate_index(folder_path)
+    result_dict = {cand_app.candidate_id: cand_app for cand_app in iter_candidate_applications(folder_path, max_workers, store, index)}
+    return [result_dict[candidate_id] for candidate_id in get_pdfs_per_id(folder_path, index)]
+
+
+def write_candidate_applications_in_place(candidate_apps: list[CandidateApplication], filepath: str) -> None:
+    """Write the candidate applications to a csv or parquet file, depending on its extension.
+    The file is replaced atomically, so that readers never see a partial file.
+    """
+    if filepath.endswith(".parquet"):
+        from columnar_output import write_table_in_place
+        write_table_in_place(candidate_apps, CandidateApplication, filepath)
+        return
+
+    from dataclass_csv import DataclassWriter
+
+    with open(f"{filepath}.tmp", "w") as f:
+        w = DataclassWriter(f, candidate_apps, CandidateApplication)
+        w.write()
+    os.replace(f"{filepath}.tmp", filepath)
+
+
+def add_output_arguments(parser) -> None:
+    """Add the command line options that configure the output files to an `argparse.ArgumentParser`."""
+    parser.add_argument("--output-format", choices=["csv", "parquet"], default="csv",
+                        help="Format of the output. Parquet files have typed columns and can be read one column at a time.")
+    parser.add_argument("--weights", default=None, help="Json file of rating weights, see scoring.py. Defaults to the built-in weights.")
+    parser.add_argument("--metrics-json", default=None, help="Json file where the time spent in each stage and the counters of the run are written.")
+    parser.add_argument("--metrics-prom", default=None, help="File where the same metrics are written in the Prometheus text format.")
+
+
+def write_metrics(args) -> None:
+    """Print the summary of the metrics of the run, and write them to the files given by the options added by `add_output_arguments`."""
+    metrics = get_metrics()
+    metrics.print_summary()
+    if args.metrics_json:
+        with open(args.metrics_json, "w", encoding="utf-8") as f:
+            f.write(metrics.to_json())
+    if args.metrics_prom:
+        with open(args.metrics_prom, "w", encoding="utf-8") as f:
+            f.write(metrics.to_prometheus_text())
+
+
+def add_extraction_arguments(parser) -> None:
+    """Add the command line options that configure text extraction to an `argparse.ArgumentParser`."""
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes used to process candidates in parallel.")
+    parser.add_argument("--cache-dir", default=None, help="Folder of the extraction cache. Defaults to a folder in the user's home.")
+    parser.add_argument("--cache-size-mb", type=int, default=None, help="Maximum size of the extraction cache, in MB.")
+    parser.add_argument("--no-cache", action="store_true", help="Always extract text from the pdfs, ignoring the extraction cache.")
+    parser.add_argument("--timeout", type=float, default=None, help="Maximum time to extract the text of a single pdf, in seconds.")
+    parser.add_argument("--memory-limit-mb", type=int, default=None, help="Maximum memory used to extract the text of a single pdf, in MB.")
+    parser.add_argument("--no-sandbox", action="store_true", help="Extract text in the same process, without time or memory limits.")
+    parser.add_argument("--pdf-backend", choices=list(pdf_backends), default=DEFAULT_PDF_BACKEND,
+                        help="Engine used to extract the text layer of pdfs. pypdfium2 is usually the fastest. pypdfium2 and pdfminer need their package installed.")
+    parser.add_argument("--ocr-preprocessing", action="store_true",
+                        help="Downscale, binarize and deskew the page images before OCR, and skip blank and photo pages. Off by default, "
+                             "until its effect on the extracted text is measured.")
+    parser.add_argument("--tesseract", default=None, help="Path of the Tesseract executable. Defaults to pdf_processing.DEFAULT_TESSERACT_EXECUTABLE_PATH.")
+    parser.add_argument("--poppler", default=None, help="Path of the Poppler bin folder. Defaults to pdf_processing.DEFAULT_POPPLER_BIN_PATH.")
+
+
+def configure_extraction(args) -> None:
+    """Set the extraction cache, sandbox and pdf backend of this process from the options added by `add_extraction_arguments`."""
+    set_extraction_options(args.pdf_backend, ocr_preprocessing=args.ocr_preprocessing,
+                           tesseract_executable_path=args.tesseract, poppler_bin_path=args.poppler)
+    if args.no_cache:
+        set_extraction_cache(None)
+    else:
+        from extraction_cache import ExtractionCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB
+        cache_dir = args.cache_dir or DEFAULT_CACHE_DIR
+        cache_size_mb = args.cache_size_mb or DEFAULT_MAX_SIZE_MB
+        set_extraction_cache(ExtractionCache(cache_dir, cache_size_mb * 1024 * 1024))
+
+    if args.no_sandbox:
+        set_extraction_sandbox(None)
+    else:
+        from extraction_sandbox import ExtractionSandbox, DEFAULT_TIMEOUT_S, DEFAULT_MEMORY_LIMIT_MB
+        set_extraction_sandbox(ExtractionSandbox(args.timeout or DEFAULT_TIMEOUT_S, args.memory_limit_mb or DEFAULT_MEMORY_LIMIT_MB))
 
 
 
 # %%
 
 if __name__ == "__main__":
+    import argparse
+
     root = r"C:\Users\alombardi\Buro Happold\Design & Technology - R&D Wishlist\00488_Machine Learning reprise\Funding\InnovateUK\KTP project\Candidates\Upto 20240211 closing date"
     #root = r"C:\Users\alombardi\Buro Happold\Design & Technology - R&D Wishlist\00488_Machine Learning reprise\Funding\InnovateUK\KTP project\Candidates\_subset"
 
-    all_candidate_apps: list[CandidateApplication] = get_all_candidate_applications(root)
+    parser = argparse.ArgumentParser(description="Extract and rate all candidate applications in a folder.")
+    parser.add_argument("root", nargs="?", default=root, help="Folder containing the candidates' pdfs.")
+    add_extraction_arguments(parser)
+    add_output_arguments(parser)
+    parser.add_argument("--intake-round", default=None,
+                        help="Name of the intake round stored with the results in parquet format, for non-incremental runs. Defaults to today's date.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process candidates with new or changed files since the last incremental run, and update the output file in place.")
+    parser.add_argument("--rescan", action="store_true",
+                        help="In incremental runs, list all folders again rather than only those whose modification time changed.")
+    parser.add_argument("--trust-folder-mtime", action="store_true",
+                        help="In incremental runs, don't stat the files of the folders whose modification time didn't change. Faster on network drives, "
+                             "but files modified in place are missed.")
+    parser.add_argument("--state-db", default=None, help="SQLite file storing the processed candidates for incremental runs. Defaults to a file in the root folder.")
+    args = parser.parse_args()
+    root = args.root
+    configure_extraction(args)
+    if args.weights:
+        from scoring import RatingWeights, set_rating_weights
+        set_rating_weights(RatingWeights.load(args.weights))
 
-    i = 0
-    while True:
-        filename = "_candidate_applications"
-        filepath = f"{os.path.join(root, filename)}{i}.csv"
-        try:
-            with open(filepath, "w") as f:
-                from dataclass_csv import DataclassWriter
-                w = DataclassWriter(f, all_candidate_apps, CandidateApplication)
-                w.write()
+    if args.incremental:
+        from candidate_store import CandidateStore, DEFAULT_STORE_FILENAME
+        from file_processing import DEFAULT_INDEX_FILENAME
+        # Unless rescanning, only the folders that changed since the last run are listed again, and the files of the others are stat-ed.
+        index_path = os.path.join(root, DEFAULT_INDEX_FILENAME)
+        if args.rescan and os.path.exists(index_path):
+            os.remove(index_path)
+        index = build_candidate_index(root, index_path, stat_files=not args.trust_folder_mtime)
+        with CandidateStore(args.state_db or os.path.join(root, DEFAULT_STORE_FILENAME)) as store:
+            all_candidate_apps: list[CandidateApplication] = get_all_candidate_applications(root, max_workers=args.workers, store=store, index=index)
+
+        # Replace the output of the previous incremental run.
+        filepath = os.path.join(root, f"{OUTPUT_FILENAME}.{args.output_format}")
+        write_candidate_applications_in_place(all_candidate_apps, filepath)
+        print(f"File written successfully:\n\t{filepath}")
+    else:
+        # Results are written as each candidate is finished, rather than once all are.
+        candidate_apps = iter_candidate_applications(root, max_workers=args.workers)
 
+        if args.output_format == "parquet":
+            import datetime
+            from columnar_output import DatasetAppender
+            intake_round = args.intake_round or datetime.date.today().isoformat()
+            with DatasetAppender(os.path.join(root, OUTPUT_DATASET_FOLDERNAME), CandidateApplication, intake_round) as appender:
+                batch: list[CandidateApplication] = []
+                for cand_app in candidate_apps:
+                    batch.append(cand_app)
+                    if len(batch) == OUTPUT_BATCH_SIZE:
+                        appender.write(batch)
+                        batch = []
+                appender.write(batch)
+            print(f"File written successfully:\n\t{appender.filepath}")
+        else:
+            from dataclass_csv import DataclassWriter
+            # Find a file that can be opened, e.g. not open in another program, before consuming the candidates.
+            i = 0
+            while True:
+                filename = "_candidate_applications"
+                filepath = f"{os.path.join(root, filename)}{i}.csv"
+                try:
+                    f = open(filepath, "w", buffering=1) # line buffered, so that each row is written as soon as the candidate is finished
+                    break
+                except Exception as e:
+                    i += 1
+
+            with f:
+                w = DataclassWriter(f, candidate_apps, CandidateApplication)
+                w.write()
             print(f"File written successfully:\n\t{filepath}")
-            break
-        except Exception as e:
-            i += 1
+
+    write_metrics(args)
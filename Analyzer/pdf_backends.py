@@ -0,0 +1,165 @@
+# %% Engines used to extract the text layer of pdfs
+from abc import ABC, abstractmethod
+from typing import Optional
+
+DEFAULT_PDF_BACKEND = "pypdf2"
+
+
+class PdfDocument(ABC):
+    """A pdf opened by one of the backends, giving access to each page by its index, from 0."""
+
+    page_count: int = 0
+
+    def __enter__(self) -> "PdfDocument":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @abstractmethod
+    def get_page_size(self, i: int) -> tuple[float, float]:
+        """Width and height of the page, in points (1/72 inch)."""
+
+    @abstractmethod
+    def has_text_layer(self, i: int) -> bool:
+        """Cheap check of the page's resources, without extracting text. False if the page can't have any text, e.g. a scanned page,
+        whose text can only be extracted by OCR. True if it may have text.
+        """
+
+    @abstractmethod
+    def extract_text(self, i: int) -> str:
+        """Text of the page's text layer."""
+
+    def close(self) -> None:
+        pass
+
+
+class PyPDF2Document(PdfDocument):
+    def __init__(self, filepath: str):
+        import PyPDF2
+
+        self.reader = PyPDF2.PdfReader(filepath)
+        self.page_count = len(self.reader.pages)
+
+    def get_page_size(self, i: int) -> tuple[float, float]:
+        mediabox = self.reader.pages[i].mediabox
+        return float(mediabox.width), float(mediabox.height)
+
+    def has_text_layer(self, i: int) -> bool:
+        # Text can only be drawn with a font, either by the page itself or by a form it includes.
+        resources = self.reader.pages[i].get("/Resources")
+        if resources is None:
+            return False
+        resources = resources.get_object()
+        if resources.get("/Font"):
+            return True
+        xobjects = resources.get("/XObject")
+        if xobjects is None:
+            return False
+        return any(xobject.get_object().get("/Subtype") == "/Form" for xobject in xobjects.get_object().values())
+
+    def extract_text(self, i: int) -> str:
+        return self.reader.pages[i].extract_text()
+
+
+class PdfiumDocument(PdfDocument):
+    """Backend based on PDFium, the pdf engine of Chrome, through the `pypdfium2` package. Native code, usually much faster than PyPDF2 on long pdfs."""
+
+    def __init__(self, filepath: str):
+        import pypdfium2
+
+        self.document = pypdfium2.PdfDocument(filepath)
+        self.page_count = len(self.document)
+        self._page_index = None
+        self._page = None
+
+    def _get_page(self, i: int):
+        # Pages are accessed in order, keep the last one loaded.
+        if self._page_index != i:
+            self._page = self.document[i]
+            self._page_index = i
+        return self._page
+
+    def get_page_size(self, i: int) -> tuple[float, float]:
+        return self._get_page(i).get_size()
+
+    def has_text_layer(self, i: int) -> bool:
+        import pypdfium2.raw as pdfium_c
+
+        # Text objects of the page, and of the forms it includes.
+        text_objects = self._get_page(i).get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_TEXT], max_depth=2)
+        return next(iter(text_objects), None) is not None
+
+    def extract_text(self, i: int) -> str:
+        text_page = self._get_page(i).get_textpage()
+        try:
+            return text_page.get_text_bounded().replace("\r\n", "\n")
+        finally:
+            text_page.close()
+
+    def close(self) -> None:
+        self._page = None
+        self.document.close()
+
+
+class PdfminerDocument(PdfDocument):
+    """Backend based on the `pdfminer.six` package, in pure Python. Slower, but recovers the layout of multi-column pages better."""
+
+    def __init__(self, filepath: str):
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        self._file = open(filepath, "rb")
+        try:
+            self.pages = list(PDFPage.create_pages(PDFDocument(PDFParser(self._file))))
+        except Exception:
+            self._file.close()
+            raise
+        self.page_count = len(self.pages)
+        self._resource_manager = PDFResourceManager(caching=True)
+
+    def get_page_size(self, i: int) -> tuple[float, float]:
+        x0, y0, x1, y1 = self.pages[i].mediabox
+        return float(x1 - x0), float(y1 - y0)
+
+    def has_text_layer(self, i: int) -> bool:
+        from pdfminer.pdftypes import PDFStream, resolve1
+
+        resources = resolve1(self.pages[i].resources) or {}
+        if resolve1(resources.get("Font")):
+            return True
+        for xobject in (resolve1(resources.get("XObject")) or {}).values():
+            xobject = resolve1(xobject)
+            if isinstance(xobject, PDFStream) and getattr(xobject.get("Subtype"), "name", None) == "Form":
+                return True
+        return False
+
+    def extract_text(self, i: int) -> str:
+        import io
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter
+
+        output = io.StringIO()
+        device = TextConverter(self._resource_manager, output, laparams=LAParams())
+        try:
+            PDFPageInterpreter(self._resource_manager, device).process_page(self.pages[i])
+        finally:
+            device.close()
+        return output.getvalue()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+pdf_backends: dict[str, type] = {"pypdf2": PyPDF2Document, "pypdfium2": PdfiumDocument, "pdfminer": PdfminerDocument}
+
+
+def open_pdf(filepath: str, backend: Optional[str] = None) -> PdfDocument:
+    """Open a pdf with one of the `pdf_backends`, by default PyPDF2. The others require their package to be installed."""
+    backend = backend or DEFAULT_PDF_BACKEND
+    if backend not in pdf_backends:
+        raise ValueError(f"Unknown pdf backend {backend}, expected one of {list(pdf_backends)}.")
+    return pdf_backends[backend](filepath)
@@ -1,9 +1,31 @@
-from dataclasses import dataclass, field
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+import math
+import os
+import tempfile
 import PyPDF2
 import cv2
 import pytesseract
-from stopit import threading_timeoutable as timeoutable
 import pathlib
+from typing import TYPE_CHECKING, Optional
+
+from instrumentation import increment, timer
+from pdf_backends import DEFAULT_PDF_BACKEND, open_pdf
+
+if TYPE_CHECKING:
+    from extraction_cache import ExtractionCache
+
+# Version of the text extraction process. Increase it whenever a change alters the extracted text, so that cached results are discarded.
+EXTRACTOR_VERSION = 6
+
+# Number of pages OCRed concurrently by each call of `read_pdf`.
+DEFAULT_OCR_WORKERS = min(4, os.cpu_count() or 1)
+# Resolution at which pages are rendered for OCR.
+DEFAULT_OCR_DPI = 200
+# Approximate ceiling on the memory taken by the page images being OCRed at the same time, by each call of `read_pdf`.
+DEFAULT_OCR_MEMORY_MB = 512
+DEFAULT_TESSERACT_EXECUTABLE_PATH = r"C:\Users\alombardi\AppData\Local\Programs\Tesseract-OCR\tesseract.exe"
+DEFAULT_POPPLER_BIN_PATH = r'C:\Users\alombardi\Desktop\Software\poppler-23.11.0\Library\bin'
 
 
 @dataclass
@@ -23,77 +45,303 @@ class PageText:
 class PdfText:
     filepath: str = ""
     text_per_page: dict[int, PageText] = field(default_factory=lambda: {})
+    page_count: int = 0
 
     def get_all_text(self) -> str:
         return " ".join([page_text.page_text for page_text in self.text_per_page.values()])
 
+    def is_complete(self) -> bool:
+        """True if text was extracted from every page of the pdf."""
+        return len(self.text_per_page) == self.page_count
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(data: dict) -> "PdfText":
+        text_per_page = {int(i): PageText(**page) for i, page in data["text_per_page"].items()}
+        return PdfText(data["filepath"], text_per_page, data["page_count"])
+
     def print_pages_text(self) -> None:
         for page_text in self.text_per_page.values():
             print(f"Page {page_text.page_num}:\n{page_text.page_text}\n")
 
 
-@timeoutable(30)
+_extraction_cache: Optional["ExtractionCache"] = None
+
+
+def set_extraction_cache(cache: Optional["ExtractionCache"]) -> None:
+    """Set the cache used by `read_pdf` in this process. Pass None to disable caching."""
+    global _extraction_cache
+    _extraction_cache = cache
+
+
+def get_extraction_cache() -> Optional["ExtractionCache"]:
+    return _extraction_cache
+
+
+# Options of `read_pdf` chosen per run, used when they are not passed explicitly.
+_extraction_options: dict = {"pdf_backend": DEFAULT_PDF_BACKEND, "ocr_preprocessing": False,
+                             "tesseract_executable_path": DEFAULT_TESSERACT_EXECUTABLE_PATH, "poppler_bin_path": DEFAULT_POPPLER_BIN_PATH}
+
+
+def set_extraction_options(pdf_backend: str = DEFAULT_PDF_BACKEND, ocr_preprocessing: bool = False,
+                           tesseract_executable_path: Optional[str] = None, poppler_bin_path: Optional[str] = None) -> None:
+    """Set the options used by `read_pdf` in this process. They are handed to worker processes with the extraction cache.
+    Args:
+        pdf_backend (str): Backend used to extract the text layer of pdfs, see `pdf_backends.pdf_backends`.
+        ocr_preprocessing (bool): Whether page images are preprocessed before OCR, see `image_preprocessing.preprocess_page_image`.
+            Off by default, until its effect on the extracted text is measured on real pdfs.
+        tesseract_executable_path (str): Path of the Tesseract executable. Defaults to DEFAULT_TESSERACT_EXECUTABLE_PATH.
+        poppler_bin_path (str): Path of the Poppler bin folder. Defaults to DEFAULT_POPPLER_BIN_PATH.
+    """
+    global _extraction_options
+    _extraction_options = {"pdf_backend": pdf_backend, "ocr_preprocessing": ocr_preprocessing,
+                           "tesseract_executable_path": tesseract_executable_path or DEFAULT_TESSERACT_EXECUTABLE_PATH,
+                           "poppler_bin_path": poppler_bin_path or DEFAULT_POPPLER_BIN_PATH}
+
+
+def get_extraction_options() -> dict:
+    return dict(_extraction_options)
+
+
 def read_pdf(filepath: str,
-                 tesseract_executable_path=r"C:\Users\alombardi\AppData\Local\Programs\Tesseract-OCR\tesseract.exe",
-                 poppler_bin_path=r'C:\Users\alombardi\Desktop\Software\poppler-23.11.0\Library\bin') -> PdfText:
-    import PyPDF2
-    import cv2
+                 tesseract_executable_path: Optional[str] = None,
+                 poppler_bin_path: Optional[str] = None,
+                 ocr_workers: int = DEFAULT_OCR_WORKERS,
+                 ocr_dpi: int = DEFAULT_OCR_DPI,
+                 ocr_memory_mb: int = DEFAULT_OCR_MEMORY_MB,
+                 pdf_backend: Optional[str] = None,
+                 ocr_preprocessing: Optional[bool] = None) -> PdfText:
+    tesseract_executable_path = tesseract_executable_path or _extraction_options["tesseract_executable_path"]
+    poppler_bin_path = poppler_bin_path or _extraction_options["poppler_bin_path"]
+    pdf_backend = pdf_backend or _extraction_options["pdf_backend"]
+    ocr_preprocessing = _extraction_options["ocr_preprocessing"] if ocr_preprocessing is None else ocr_preprocessing
+    cache = _extraction_cache
+    if cache is None:
+        return extract_pdf_text(filepath, tesseract_executable_path, poppler_bin_path, ocr_workers, ocr_dpi, ocr_memory_mb, pdf_backend,
+                                ocr_preprocessing)
+
+    settings = {"tesseract_executable_path": tesseract_executable_path, "poppler_bin_path": poppler_bin_path,
+                "ocr_dpi": ocr_dpi, "ocr_memory_mb": ocr_memory_mb, "ocr_preprocessing": ocr_preprocessing}
+    if pdf_backend != DEFAULT_PDF_BACKEND:
+        # Backends extract slightly different text.
+        settings["pdf_backend"] = pdf_backend
+    cache_key = cache.get_key(filepath, settings)
+    pdf_text = cache.get(cache_key)
+    increment("cache_hits" if pdf_text is not None else "cache_misses")
+    if pdf_text is not None:
+        print(f"\tUsing cached text for file: {pathlib.Path(filepath).name}.")
+        pdf_text.filepath = filepath
+        return pdf_text
+
+    pdf_text = extract_pdf_text(filepath, tesseract_executable_path, poppler_bin_path, ocr_workers, ocr_dpi, ocr_memory_mb, pdf_backend,
+                                ocr_preprocessing)
+    # Don't cache partial results, so that pages that failed are attempted again on the next run.
+    if pdf_text.is_complete():
+        cache.put(cache_key, pdf_text)
+    return pdf_text
+
+
+def extract_pdf_text(filepath: str, tesseract_executable_path: str, poppler_bin_path: str, ocr_workers: int = 1,
+                     ocr_dpi: int = DEFAULT_OCR_DPI, ocr_memory_mb: int = DEFAULT_OCR_MEMORY_MB,
+                     pdf_backend: str = DEFAULT_PDF_BACKEND, ocr_preprocessing: bool = False) -> PdfText:
     import pytesseract
     pytesseract.pytesseract.tesseract_cmd = tesseract_executable_path
-    import numpy as np
-    from pdf2image import convert_from_bytes
+    from pdf2image import convert_from_path
     
     # create a df to save each pdf's text
     pdf_text = PdfText(filepath, {})
+    filename = pathlib.Path(filepath).name
 
     # open the pdf file
-    reader = PyPDF2.PdfReader(filepath)
-    print(f"\tAttempting text extraction for file: {pathlib.Path(filepath).name}.")
-
-    # extract text and do the search
-    for (i, page) in enumerate(reader.pages):
-        text = page.extract_text()
-        all_words = text.split()
-        words = [w for w in all_words if w.isalpha()]
-        if len(words) > 50:
-            pdf_text.text_per_page[i] = PageText(i + 1, 100, text)
-
-    if len(pdf_text.text_per_page.keys()) < len(reader.pages):
-        print(f"\t\tCould not directly extract text from all pages of pdf: {pathlib.Path(filepath).name}.")
+    print(f"\tAttempting text extraction for file: {filename}.")
+    failed_pages: list[int] = []
+    image_only_pages = 0
+    with open_pdf(filepath, pdf_backend) as document, timer("direct_extraction", filename):
+        pdf_text.page_count = document.page_count
+        for i in range(document.page_count):
+            # Pages without any text, e.g. scanned pages, go straight to OCR.
+            if not document.has_text_layer(i):
+                failed_pages.append(i)
+                image_only_pages += 1
+                continue
+
+            text = document.extract_text(i)
+            if has_enough_words(text):
+                pdf_text.text_per_page[i] = PageText(i + 1, 100, text)
+            else:
+                failed_pages.append(i)
+        # Needed to render the pages for OCR.
+        page_sizes = {i: document.get_page_size(i) for i in failed_pages}
+    increment("pages_total", pdf_text.page_count)
+    increment("pages_direct", pdf_text.page_count - len(failed_pages))
+    increment("pages_ocr", len(failed_pages))
+    increment("pages_image_only", image_only_pages)
+
+    if failed_pages:
+        print(f"\t\tCould not directly extract text from {len(failed_pages)} of {pdf_text.page_count} pages of pdf: {filename}.")
     else:
         print(f"\tText extraction successful.")
         return pdf_text
 
-    def get_conf(page_gray):
-        '''return a average confidence value of OCR result '''
-        df = pytesseract.image_to_data(page_gray, output_type='data.frame')
-        df.drop(df[df.conf == -1].index.values, inplace=True)
-        df.reset_index()
-        return df.conf.mean()
-
-    print("\t\tAttempting OCR text extraction.")
-    # Convert pdf into image.
-    # This requires to have Poppler installed -- check https://github.com/Belval/pdf2image?tab=readme-ov-file#how-to-install
-    pdf_file = convert_from_bytes(open(filepath, 'rb').read(), poppler_path=poppler_bin_path)
-
-    for (i, page) in enumerate(pdf_file):
-        try:
-            # transfer image of pdf_file into array
-            page_arr = np.asarray(page)
-            # transfer into grayscale
-            page_arr_gray = cv2.cvtColor(page_arr, cv2.COLOR_BGR2GRAY)
-            # get confidence value
-            page_conf = get_conf(page_arr_gray)
-            # extract text
-            page_text = pytesseract.image_to_string(page_arr_gray)
-
-            pdf_text.text_per_page[i] = PageText(i + 1, page_conf, page_text)
-        except Exception as e:
-            from traceback import print_exc, print_tb
-            print(
-                f"\tCould not extract text from page {i} of pdf {pathlib.Path(filepath).name}.Error:\n\t\t{type(e).__name__} {e.args}")
-            continue
+    print("\t\tAttempting OCR text extraction of the remaining pages.")
+    if ocr_workers > 1:
+        # Pages are already OCRed in parallel, stop each Tesseract process from spawning its own threads on top of that.
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    def collect(done_futures: set[Future]) -> None:
+        for future in done_futures:
+            i, _ = pending.pop(future)
+            try:
+                result = future.result()
+                if result is None:
+                    # Skipped by the preprocessing. Left out of the text, so that the pdf is not cached and the page is OCRed again
+                    # by the next run, rather than its possibly wrong skip being kept.
+                    continue
+                page_conf, page_text = result
+                pdf_text.text_per_page[i] = PageText(i + 1, page_conf, page_text)
+                if not math.isnan(page_conf): # some text was found
+                    # The mean confidence of a run, compared between runs with and without preprocessing, shows the accuracy it costs.
+                    increment("ocr_pages_with_text")
+                    increment("ocr_confidence_sum", page_conf)
+            except Exception as e:
+                increment("ocr_failures")
+                print(
+                    f"\tCould not extract text from page {i} of pdf {pathlib.Path(filepath).name}.Error:\n\t\t{type(e).__name__} {e.args}")
+
+    # Pages are rendered one at a time to image files in a temporary folder, and each image is only loaded by the OCR worker.
+    # New pages are rendered only while the images in flight fit within the memory budget, and at most 2 per worker are queued.
+    # OCR is run by Tesseract subprocesses, so threads are enough to process pages concurrently.
+    memory_budget = ocr_memory_mb * 1024 * 1024
+    pending: dict[Future, tuple[int, int]] = {} # page index and estimated image size of the pages in flight
+    max_pending = 2 * ocr_workers
+    with tempfile.TemporaryDirectory(prefix="cv_analyzer_ocr_") as images_folder, ThreadPoolExecutor(max_workers=ocr_workers) as executor:
+        for i in failed_pages:
+            page_dpi = get_page_dpi(page_sizes[i], ocr_dpi, memory_budget)
+            page_bytes = get_page_image_size(page_sizes[i], page_dpi)
+            while pending and (len(pending) >= max_pending or sum(b for _, b in pending.values()) + page_bytes > memory_budget):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            try:
+                # Convert the page into an image.
+                # This requires to have Poppler installed -- check https://github.com/Belval/pdf2image?tab=readme-ov-file#how-to-install
+                with timer("rasterize", f"{filename} page {i + 1}"):
+                    page_image_path = convert_from_path(filepath, dpi=page_dpi, first_page=i + 1, last_page=i + 1, grayscale=True,
+                                                        output_folder=images_folder, output_file=f"page{i}", paths_only=True,
+                                                        poppler_path=poppler_bin_path)[0]
+            except Exception as e:
+                increment("rasterize_failures")
+                print(
+                    f"\tCould not convert page {i} of pdf {pathlib.Path(filepath).name} to image.Error:\n\t\t{type(e).__name__} {e.args}")
+                continue
+            pending[executor.submit(ocr_page, page_image_path, f"{filename} page {i + 1}", page_dpi if ocr_preprocessing else None)] = (i, page_bytes)
 
+        collect(wait(pending).done)
+
+    # OCRed pages were added after the directly extracted ones, restore the page order.
+    pdf_text.text_per_page = dict(sorted(pdf_text.text_per_page.items()))
     print(f"\tText extraction successful.")
 
-    return pdf_text
\ No newline at end of file
+    return pdf_text
+
+
+def ocr_page(page_image_path: str, label: Optional[str] = None, preprocessing_dpi: Optional[int] = None) -> Optional[tuple[float, str]]:
+    """OCR a page image, deleting the image file once loaded.
+    Returns the mean confidence of the recognized words, from 0 to 100, and the text of the page, or None if the page was skipped.
+    Args:
+        label (str): Name of the page in the metrics of the OCR stage.
+        preprocessing_dpi (int): Resolution of the image. If given, the image is preprocessed before OCR, and blank pages or pages
+            with only photos are skipped, see `image_preprocessing.preprocess_page_image`.
+    """
+    import cv2
+    import pytesseract
+
+    # load the page image in grayscale
+    page_arr_gray = cv2.imread(page_image_path, cv2.IMREAD_GRAYSCALE)
+    os.remove(page_image_path)
+    if page_arr_gray is None:
+        raise ValueError(f"Could not read page image {page_image_path}.")
+    label = label or pathlib.Path(page_image_path).name
+
+    config = ""
+    if preprocessing_dpi is not None:
+        from image_preprocessing import preprocess_page_image
+
+        with timer("preprocess", label):
+            page = preprocess_page_image(page_arr_gray, preprocessing_dpi)
+        increment("ocr_input_megapixels", page_arr_gray.size / 1e6)
+        if page.image is None:
+            increment(f"pages_skipped_{page.skip_reason}")
+            return None
+        page_arr_gray = page.image
+        config = f"--dpi {page.dpi}"
+        increment("ocr_preprocessed_megapixels", page_arr_gray.size / 1e6)
+
+    # get confidence value and text from a single Tesseract run
+    with timer("ocr", label):
+        ocr_data = pytesseract.image_to_data(page_arr_gray, config=config, output_type=pytesseract.Output.DICT)
+    return parse_ocr_data(ocr_data)
+
+
+def parse_ocr_data(ocr_data: dict[str, list]) -> tuple[float, str]:
+    """Get the mean confidence and the text of a page from the output of `pytesseract.image_to_data`.
+    Words are joined into lines, lines into paragraphs separated by an empty line, following Tesseract's reading order.
+    Args:
+        ocr_data (dict[str, list]): Output of `image_to_data` with `output_type=Output.DICT`, one list per tsv column.
+    Returns:
+        tuple[float, str]: Mean confidence of the recognized words, from 0 to 100 (nan if there are none), and the text of the page.
+    """
+    confidences: list[float] = []
+    paragraphs: list[list[tuple[int, int, int]]] = []
+    lines: dict[tuple[int, int, int], list[str]] = {}
+    current_paragraph = None
+    for block_num, par_num, line_num, conf, word in zip(ocr_data["block_num"], ocr_data["par_num"], ocr_data["line_num"],
+                                                         ocr_data["conf"], ocr_data["text"]):
+        conf = float(conf)
+        if conf == -1:
+            continue # not a word, but a page, block, paragraph or line entry
+        confidences.append(conf)
+
+        word = str(word).strip()
+        if not word:
+            continue
+        if (block_num, par_num) != current_paragraph:
+            current_paragraph = (block_num, par_num)
+            paragraphs.append([])
+        line_key = (block_num, par_num, line_num)
+        if line_key not in lines:
+            lines[line_key] = []
+            paragraphs[-1].append(line_key)
+        lines[line_key].append(word)
+
+    page_conf = sum(confidences) / len(confidences) if confidences else float("nan")
+    page_text = "\n\n".join("\n".join(" ".join(lines[line_key]) for line_key in paragraph) for paragraph in paragraphs)
+    return page_conf, page_text
+
+
+def has_enough_words(text: str, min_words: int = 50) -> bool:
+    """True if `text` has more than `min_words` alphabetic words, i.e. it was really extracted rather than e.g. only page numbers or garbage."""
+    words = 0
+    for w in text.split():
+        if w.isalpha():
+            words += 1
+            if words > min_words:
+                return True
+    return False
+
+
+def get_page_image_size(page_size: tuple[float, float], dpi: int) -> int:
+    """Estimate the size in bytes of the 8-bit grayscale image of a pdf page of `page_size` points, rendered at `dpi`."""
+    width_in = page_size[0] / 72
+    height_in = page_size[1] / 72
+    return int(width_in * dpi * height_in * dpi)
+
+
+def get_page_dpi(page_size: tuple[float, float], dpi: int, max_image_bytes: int) -> int:
+    """Returns `dpi`, lowered if needed so that the image of the page fits within `max_image_bytes`, e.g. for posters or drawings."""
+    image_bytes = get_page_image_size(page_size, dpi)
+    if image_bytes <= max_image_bytes:
+        return dpi
+    return max(int(dpi * (max_image_bytes / image_bytes) ** 0.5), 1)
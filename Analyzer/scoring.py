@@ -0,0 +1,136 @@
+# %% Rating of candidate applications, computed for all candidates at once
+from dataclasses import asdict, dataclass
+import json
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+mention_columns = ["mentions_pytorch", "mentions_tensorflow", "mentions_csharp", "mentions_computervision", "mentions_azure", "mentions_aws"]
+answer_columns = ["answer1", "answer2", "answer3", "answer4", "answer5"]
+
+
+@dataclass
+class RatingWeights:
+    """Weights of the features in the rating of a candidate application. Load them from a json file to re-rank candidates with different weights.
+    Answers are penalized by length: very short answers (between 0 and `very_short_answer_length` characters, both excluded) sometimes
+    indicate a link to another document, which is invalid; short answers (between `very_short_answer_length` and `short_answer_length`,
+    both excluded) are too short; long answers (over `long_answer_length`) are too long.
+    """
+    mentions_pytorch: float = 1
+    mentions_tensorflow: float = 1 / 2
+    mentions_csharp: float = 1 / 2
+    mentions_computervision: float = 1
+    mentions_azure: float = 1
+    mentions_aws: float = 1 / 1.1
+    buzzword_count: float = -1 / 1.75
+    very_short_answer: float = -1
+    short_answer: float = -0.5
+    long_answer: float = -0.5
+    very_short_answer_length: int = 30
+    short_answer_length: int = 250
+    long_answer_length: int = 1800
+
+    def save(self, filepath: str) -> None:
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, indent=4)
+
+    @staticmethod
+    def load(filepath: str) -> "RatingWeights":
+        with open(filepath, "r", encoding="utf-8") as f:
+            return RatingWeights(**json.load(f))
+
+
+_rating_weights = RatingWeights()
+
+
+def set_rating_weights(weights: RatingWeights) -> None:
+    """Set the weights used to rate candidates in this process."""
+    global _rating_weights
+    _rating_weights = weights
+
+
+def get_rating_weights() -> RatingWeights:
+    return _rating_weights
+
+
+def get_features(candidate_apps: Iterable[Any]) -> dict[str, np.ndarray]:
+    """Feature columns of candidate applications, one entry per candidate: the mention flags, the buzzword count, the processing errors
+    flag and `answer_lengths`, of shape (number of candidates, 5). Missing answers have length 0.
+    """
+    candidate_apps = list(candidate_apps)
+    features = {column: np.array([getattr(c, column) for c in candidate_apps], dtype=bool) for column in mention_columns}
+    features["buzzword_count"] = np.array([c.buzzword_count for c in candidate_apps], dtype=np.int64)
+    features["has_processing_errors"] = np.array([c.has_processing_errors for c in candidate_apps], dtype=bool)
+    features["answer_lengths"] = np.array([[len(getattr(c, column) or "") for column in answer_columns] for c in candidate_apps],
+                                          dtype=np.int64).reshape(len(candidate_apps), len(answer_columns))
+    return features
+
+
+def get_features_from_table(table) -> dict[str, np.ndarray]:
+    """Same as `get_features`, for a `pyarrow.Table` of candidate applications, e.g. read with `columnar_output.read_table`."""
+    import pyarrow.compute as pc
+
+    features = {column: table[column].fill_null(False).to_numpy() for column in mention_columns + ["has_processing_errors"]}
+    features["buzzword_count"] = table["buzzword_count"].fill_null(0).to_numpy()
+    features["answer_lengths"] = np.stack([pc.utf8_length(table[column]).fill_null(0).to_numpy() for column in answer_columns], axis=1) \
+        if table.num_rows > 0 else np.zeros((0, len(answer_columns)), dtype=np.int64)
+    return features
+
+
+def compute_ratings(features: dict[str, np.ndarray], weights: Optional[RatingWeights] = None) -> np.ndarray:
+    """Rate all candidates at once from their feature columns. Candidates with processing errors are not rated, their rating is nan."""
+    weights = weights or _rating_weights
+    ratings = np.zeros(len(features["has_processing_errors"]), dtype=np.float64)
+    for column in mention_columns:
+        ratings += getattr(weights, column) * features[column]
+    ratings += weights.buzzword_count * features["buzzword_count"]
+
+    lengths = features["answer_lengths"]
+    penalties = np.select(
+        [(lengths > 0) & (lengths < weights.very_short_answer_length),
+         (lengths > weights.very_short_answer_length) & (lengths < weights.short_answer_length),
+         lengths > weights.long_answer_length],
+        [weights.very_short_answer, weights.short_answer, weights.long_answer],
+        default=0)
+    ratings += penalties.sum(axis=1)
+
+    ratings[features["has_processing_errors"]] = np.nan
+    return ratings
+
+
+def rate_candidate_applications(candidate_apps: list[Any], weights: Optional[RatingWeights] = None) -> None:
+    """Set the `rating` of all the candidate applications, in a single vectorized pass."""
+    ratings = compute_ratings(get_features(candidate_apps), weights)
+    for cand_app, rating in zip(candidate_apps, ratings):
+        cand_app.rating = None if np.isnan(rating) else float(rating)
+
+
+# %%
+
+if __name__ == "__main__":
+    import argparse
+
+    from columnar_output import read_table
+
+    parser = argparse.ArgumentParser(description="Re-rank candidate applications stored in parquet format, without extracting their files again.")
+    parser.add_argument("results", help="Parquet file or dataset folder of candidate applications.")
+    parser.add_argument("--weights", default=None, help="Json file of rating weights. Defaults to the built-in weights.")
+    parser.add_argument("--save-default-weights", default=None, metavar="JSON", help="Write the built-in weights to a json file, to edit them.")
+    parser.add_argument("--intake-round", nargs="*", default=None, help="Only rank the candidates of these intake rounds.")
+    parser.add_argument("--top", type=int, default=20, help="Number of candidates to print.")
+    args = parser.parse_args()
+
+    if args.save_default_weights:
+        RatingWeights().save(args.save_default_weights)
+    weights = RatingWeights.load(args.weights) if args.weights else RatingWeights()
+
+    columns = ["candidate_id", "fullname"] + mention_columns + ["buzzword_count", "has_processing_errors"] + answer_columns
+    table = read_table(args.results, columns=columns, intake_rounds=args.intake_round)
+    ratings = compute_ratings(get_features_from_table(table), weights)
+
+    candidate_ids = table["candidate_id"].to_numpy()
+    fullnames = table["fullname"].to_pylist()
+    order = np.argsort(np.where(np.isnan(ratings), -np.inf, ratings))[::-1]
+    print(f"Ranked {len(ratings)} candidate applications.")
+    for rank, i in enumerate(order[:args.top], start=1):
+        print(f"{rank:>4}. {candidate_ids[i]:>6} {fullnames[i] or '':<40} {ratings[i]:.3f}")
@@ -0,0 +1,176 @@
+# %% Synthetic corpus of candidate applications, to benchmark the pipeline without real candidates' data
+import os
+import random
+import textwrap
+
+from pdf_processing import has_enough_words
+from text_processing import all_questions, buzzwords, nice_to_haves
+
+PROFILES = ["text", "image", "mixed", "long"]
+
+# Layout of the generated A4 pages, in points.
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 10
+LINE_HEIGHT = 12
+LINE_WIDTH_CHARS = 95
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LINE_HEIGHT
+
+_filler_words = ("the project team data model analysis design building structure engineering research results method approach "
+                 "experience python code software learning network training dataset performance system company client problem solution "
+                 "developed implemented worked studied improved delivered managed tested built used with for and of in on to a").split()
+_first_names = ["Alex", "Sam", "Maria", "John", "Priya", "Chen", "Fatima", "Luca", "Anna", "Tom"]
+_last_names = ["Smith", "Rossi", "Patel", "Wang", "Garcia", "Brown", "Khan", "Muller", "Silva", "Jones"]
+
+
+def get_random_paragraph(rng: random.Random, n_words: int) -> str:
+    """Random text of `n_words` words, with some of the nice-to-have skills and buzzwords that the pipeline looks for."""
+    terms = nice_to_haves + buzzwords
+    words = [rng.choice(terms) if rng.random() < 0.03 else rng.choice(_filler_words) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def get_application_lines(rng: random.Random, answer_words: int) -> list[str]:
+    """Lines of an application form, with the questions followed by their answers and the "Additional Information" section."""
+    lines = ["Application form", ""]
+    for question in all_questions:
+        lines += textwrap.wrap(question, LINE_WIDTH_CHARS)
+        lines += textwrap.wrap(get_random_paragraph(rng, answer_words), LINE_WIDTH_CHARS)
+        lines.append("")
+    lines.append("Additional Information")
+    lines += textwrap.wrap(get_random_paragraph(rng, 60), LINE_WIDTH_CHARS)
+    return lines
+
+
+def get_cv_lines(rng: random.Random, fullname: str, n_paragraphs: int = 6) -> list[str]:
+    lines = [fullname, "Curriculum Vitae", ""]
+    for _ in range(n_paragraphs):
+        lines += textwrap.wrap(get_random_paragraph(rng, rng.randint(60, 120)), LINE_WIDTH_CHARS)
+        lines.append("")
+    return lines
+
+
+def paginate(lines: list[str]) -> list[list[str]]:
+    """Split lines into pages. Lines of the previous page are moved to a short last page until it has enough words to be extracted
+    directly, see `pdf_processing.has_enough_words`, so that text pdfs never need OCR.
+    """
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    if len(pages) > 1:
+        while not has_enough_words(" ".join(pages[-1])) and pages[-2]:
+            pages[-1].insert(0, pages[-2].pop())
+    return pages
+
+
+def write_text_pdf(filepath: str, pages: list[list[str]]) -> None:
+    """Write a pdf with a text layer, from which text can be extracted directly. Written by hand to avoid a dependency for benchmarks only."""
+    def escape(line: str) -> bytes:
+        return line.encode("latin-1", "replace").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+    # Objects 1 to 3 are the catalog, the page tree and the font, followed by the content stream and page of each page.
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        stream = b"BT /F1 %d Tf %d %d Td %d TL " % (FONT_SIZE, MARGIN, PAGE_HEIGHT - MARGIN, LINE_HEIGHT)
+        stream += b" ".join(b"(" + escape(line) + b") '" for line in lines) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+                       % (PAGE_WIDTH, PAGE_HEIGHT, len(objects)))
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref_offset = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(filepath, "wb") as f:
+        f.write(content)
+
+
+def write_image_pdf(filepath: str, pages: list[list[str]], dpi: int = 150) -> None:
+    """Write a pdf of scanned-like pages, images without a text layer, whose text can only be extracted by OCR."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    scale = dpi / 72
+    font = ImageFont.load_default(size=int(FONT_SIZE * scale))
+    images = []
+    for lines in pages:
+        image = Image.new("L", (int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)), color=255)
+        draw = ImageDraw.Draw(image)
+        for i, line in enumerate(lines):
+            draw.text((MARGIN * scale, (MARGIN + i * LINE_HEIGHT) * scale), line, fill=0, font=font)
+        images.append(image)
+    images[0].save(filepath, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+
+
+def write_mixed_pdf(filepath: str, pages: list[list[str]]) -> None:
+    """Write a pdf whose first page has a text layer and whose other pages are images, like an application with scanned attachments."""
+    import PyPDF2
+
+    write_text_pdf(f"{filepath}.text.tmp", pages[:1])
+    write_image_pdf(f"{filepath}.image.tmp", pages[1:] or [[]])
+    writer = PyPDF2.PdfWriter()
+    for part in [f"{filepath}.text.tmp", f"{filepath}.image.tmp"]:
+        for page in PyPDF2.PdfReader(part).pages:
+            writer.add_page(page)
+    with open(filepath, "wb") as f:
+        writer.write(f)
+    os.remove(f"{filepath}.text.tmp")
+    os.remove(f"{filepath}.image.tmp")
+
+
+def generate_corpus(root: str, n_candidates: int, profile: str = "text", seed: int = 0, first_id: int = 1) -> list[str]:
+    """Generate the pdfs of `n_candidates` candidates in `root`, named like the real ones: "<id> - application.pdf" and "<id> - <name> CV.pdf".
+    The same arguments always generate the same corpus.
+    Args:
+        profile (str): "text" for pdfs with a text layer, "image" for image-only pdfs that require OCR, "mixed" for applications with
+            a text first page and image pages and image-only CVs, "long" for text pdfs with answers over the long answer length.
+    Returns:
+        list[str]: Paths of the generated pdfs.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile}, expected one of {PROFILES}.")
+
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    filepaths = []
+    for candidate_id in range(first_id, first_id + n_candidates):
+        fullname = f"{rng.choice(_first_names)} {rng.choice(_last_names)}"
+        answer_words = rng.randint(350, 500) if profile == "long" else rng.randint(50, 150)
+        application_pages = paginate(get_application_lines(rng, answer_words))
+        cv_pages = paginate(get_cv_lines(rng, fullname))
+
+        application_filepath = os.path.join(root, f"{candidate_id} - application.pdf")
+        cv_filepath = os.path.join(root, f"{candidate_id} - {fullname} CV.pdf")
+        if profile == "image":
+            write_image_pdf(application_filepath, application_pages)
+            write_image_pdf(cv_filepath, cv_pages)
+        elif profile == "mixed":
+            write_mixed_pdf(application_filepath, application_pages)
+            write_image_pdf(cv_filepath, cv_pages)
+        else:
+            write_text_pdf(application_filepath, application_pages)
+            write_text_pdf(cv_filepath, cv_pages)
+        filepaths += [application_filepath, cv_filepath]
+    return filepaths
+
+
+# %%
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus of candidate applications.")
+    parser.add_argument("root", help="Folder where the pdfs are written.")
+    parser.add_argument("--candidates", type=int, default=20, help="Number of candidates.")
+    parser.add_argument("--profile", choices=PROFILES, default="text", help="Kind of pdfs generated.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+    args = parser.parse_args()
+
+    filepaths = generate_corpus(args.root, args.candidates, args.profile, args.seed)
+    print(f"Generated {len(filepaths)} pdfs in {args.root}.")
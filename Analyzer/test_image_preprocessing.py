@@ -0,0 +1,85 @@
+# %% Regression tests of the page preprocessing, on synthetic A4 pages rendered at 200 dpi. Run with `python -m pytest test_image_preprocessing.py`.
+import cv2
+import numpy as np
+import pytest
+
+from image_preprocessing import preprocess_page_image
+
+DPI = 200
+PAGE_SHAPE = (2339, 1654)
+
+
+def get_page(background: int = 255, noise_std: float = 0.0) -> np.ndarray:
+    """A page of black text lines on a flat background, with the grain of a scan if `noise_std` is given."""
+    page = np.full(PAGE_SHAPE, background, np.uint8)
+    for i in range(40):
+        cv2.putText(page, "The quick brown fox jumps over the lazy dog 0123456789", (100, 150 + i * 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2, cv2.LINE_AA)
+    if noise_std:
+        noise = np.random.default_rng(0).normal(0, noise_std, PAGE_SHAPE)
+        page = np.clip(page + noise, 0, 255).astype(np.uint8)
+    return page
+
+
+def get_photo(shape: tuple[int, int]) -> np.ndarray:
+    """A continuous-tone image, smooth at small scale like a photo."""
+    photo = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 256, (600, 500)).astype(np.uint8), (0, 0), 3)
+    photo = cv2.normalize(photo, None, 0, 255, cv2.NORM_MINMAX)
+    return cv2.resize(photo, (shape[1], shape[0]))
+
+
+def get_ink_fraction(page, x0: float = 0.0, x1: float = 1.0) -> float:
+    # Columns are given as fractions of the width, as the page may be downscaled.
+    width = page.image.shape[1]
+    return float((page.image[:, int(x0 * width):int(x1 * width)] == 0).mean())
+
+
+@pytest.mark.parametrize("background", [255, 190, 150])
+@pytest.mark.parametrize("noise_std", [0, 8])
+def test_tinted_pages_are_kept(background, noise_std):
+    # More than half of the pixels of these pages are mid-gray, but their background is flat, not a photo.
+    page = preprocess_page_image(get_page(background, noise_std), DPI)
+    assert page.skip_reason is None
+    assert page.photo_fraction < 0.05
+    assert get_ink_fraction(page) > 0.01
+
+
+def test_sidebar_text_is_kept():
+    gray = np.full(PAGE_SHAPE, 255, np.uint8)
+    gray[:, :500] = 180
+    for i in range(40):
+        cv2.putText(gray, "Skills Python", (30, 150 + i * 50), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2, cv2.LINE_AA)
+        cv2.putText(gray, "Experience text body here", (600, 150 + i * 50), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2, cv2.LINE_AA)
+    page = preprocess_page_image(gray, DPI)
+    assert page.skip_reason is None
+    assert page.photo_fraction == 0
+    # The text of the shaded sidebar is still there once binarized, and the shade itself is not ink.
+    sidebar_ink = get_ink_fraction(page, 0, 500 / PAGE_SHAPE[1])
+    assert 0.02 < sidebar_ink < 0.3
+
+
+def test_photo_next_to_text_is_blanked_out():
+    gray = get_page()
+    gray[100:700, 1100:1600] = get_photo((600, 500))
+    page = preprocess_page_image(gray, DPI)
+    assert page.skip_reason is None
+    assert 0.05 < page.photo_fraction < 0.15
+
+
+def test_photo_page_is_skipped():
+    gray = np.full(PAGE_SHAPE, 255, np.uint8)
+    gray[300:1500, 300:1300] = get_photo((1200, 1000))
+    page = preprocess_page_image(gray, DPI)
+    assert page.image is None
+    assert page.skip_reason == "photo"
+
+
+def test_blank_page_is_skipped():
+    page = preprocess_page_image(np.full(PAGE_SHAPE, 235, np.uint8), DPI)
+    assert page.skip_reason == "blank"
+
+
+def test_page_with_a_single_line_is_kept():
+    gray = np.full(PAGE_SHAPE, 255, np.uint8)
+    cv2.putText(gray, "Page 2", (700, 2200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2, cv2.LINE_AA)
+    assert preprocess_page_image(gray, DPI).skip_reason is None
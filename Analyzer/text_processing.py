@@ -1,3 +1,6 @@
+import re
+from typing import Optional
+
 # Questions text
 question1 = "1. Please briefly illustrate the nature and scope of your previous experiences and interests, explaining relevant connections to this role (50-150 words) (essential to the job)"
 question2 = "2. Please illustrate the reasons why you would like to work in this position and industry, including your personal ambitions for the future (50-150 words) (essential to the job)"
@@ -14,42 +17,87 @@ buzzwords: list[str] = ["cutting-edge", "state-of-the-art", "innovative", "revol
 nice_to_haves: list[str] = ["pytorch", "tensorflow", "c#", "computer vision", "cad", "azure", "aws", "git"]
 
 
-def count_buzzwords(text) -> int:
-    buzzword_count = 0
-    for buzzword in buzzwords:
-        if buzzword in text.lower():
-            buzzword_count += 1
-    return buzzword_count
+class KeywordMatcher:
+    """Finds all the occurrences of a list of terms in a text, in a single pass over the text with one combined regex.
+    Terms are matched case-insensitively and as whole words only, e.g. "git" does not match "digital".
+    Spaces in a term match any whitespace, so "computer vision" is also found when split across two lines.
+    """
+
+    def __init__(self, terms: list[str]):
+        self.terms: list[str] = list(dict.fromkeys(t.lower() for t in terms))
+        # Longest terms first, so that a term is preferred over any shorter term it starts with.
+        alternatives = [re.escape(t).replace(r"\ ", r"\s+") for t in sorted(self.terms, key=len, reverse=True)]
+        self.pattern = re.compile(rf"(?<!\w)(?:{'|'.join(alternatives)})(?!\w)", re.IGNORECASE)
+
+    def find_all(self, text: str) -> dict[str, list[int]]:
+        """Returns the start positions in `text` of each term found. Terms that were not found are not included."""
+        hits: dict[str, list[int]] = {}
+        for match in self.pattern.finditer(text):
+            term = " ".join(match.group().lower().split())
+            hits.setdefault(term, []).append(match.start())
+        return hits
+
+    def count_all(self, text: str) -> dict[str, int]:
+        """Returns the number of occurrences in `text` of each term found."""
+        return {term: len(positions) for term, positions in self.find_all(text).items()}
+
+
+keyword_matcher = KeywordMatcher(buzzwords + nice_to_haves + ai_terms)
+
+
+def find_keywords(text: str) -> dict[str, list[int]]:
+    """Returns the positions of all the buzzwords, nice-to-haves and ai terms found in `text`."""
+    return keyword_matcher.find_all(text)
+
+
+def count_buzzwords(text: str, keyword_hits: Optional[dict[str, list[int]]] = None) -> int:
+    """Returns the number of distinct buzzwords found in `text`.
+    Args:
+        keyword_hits (dict[str, list[int]]): Result of `find_keywords` for `text`, to avoid scanning the text again.
+    """
+    if keyword_hits is None:
+        keyword_hits = find_keywords(text)
+    return sum(1 for buzzword in buzzwords if buzzword in keyword_hits)
+
+
+# Matches any line containing the beginning of a question.
+_question_header_pattern = re.compile("|".join(re.escape(t) for t in all_questions_initial_text))
+# All questions in a single string, to check whether a line is part of a question. "\0" never appears in a line, so no line spans two questions.
+_all_questions_joined = "\0".join(all_questions)
 
 
 def get_answers_from_text(text: str) -> dict[int, str]:
-    import text_processing
+    """Split the text of an application into the answers to the questions, numbered from 1 in order of appearance.
+    Each answer is the text between a question, including the following lines that are part of the question text, and the next question
+    or the "Additional Information" section.
+    """
+    lines = text.split("\n")
+
+    # Locate all question headers and section ends in a single scan.
+    header_idxs: list[int] = []
+    end_idxs: list[int] = []
+    for line_idx, line in enumerate(lines):
+        if _question_header_pattern.search(line):
+            header_idxs.append(line_idx)
+        elif "Additional Information" in line:
+            end_idxs.append(line_idx)
 
     answers = {}
-    # split the text into lines
-    lines = text.split("\n")
-    # find the first line that contains the word "answer"
-    question_idx = 1
-    for line_idx in range(len(lines)):
-        line = lines[line_idx]
-        if any(t in line for t in text_processing.all_questions_initial_text):
-            # get the answer text
-            line_idx += 1
-            line = lines[line_idx]
-            answer_text = ""
-            while any(line in t for t in text_processing.all_questions):
-                line_idx += 1
-                line = lines[line_idx]
-
-            while line_idx < len(lines) - 1:
-                line = lines[line_idx]
-                if any(t in line for t in text_processing.all_questions_initial_text) or "Additional Information" in line:
-                    break
-
-                answer_text = " ".join([answer_text.rstrip(), line])
-                line_idx += 1
-
-            answers[question_idx] = answer_text.strip()
-            question_idx += 1
-
-    return answers
\ No newline at end of file
+    next_end = 0
+    for question_idx, header_idx in enumerate(header_idxs, start=1):
+        next_header_idx = header_idxs[question_idx] if question_idx < len(header_idxs) else len(lines)
+
+        # Skip the remaining lines of the question text, without going past the next question.
+        start_idx = header_idx + 1
+        while start_idx < next_header_idx and lines[start_idx] in _all_questions_joined:
+            start_idx += 1
+
+        # The answer stops at the next question or "Additional Information" line, whichever comes first.
+        while next_end < len(end_idxs) and end_idxs[next_end] < start_idx:
+            next_end += 1
+        stop_idx = min(next_header_idx, end_idxs[next_end]) if next_end < len(end_idxs) else next_header_idx
+
+        answer_lines = (line.rstrip() for line in lines[start_idx:stop_idx])
+        answers[question_idx] = " ".join(line for line in answer_lines if line).strip()
+
+    return answers
@@ -0,0 +1,255 @@
+# %% Continuous ingestion of the candidate files added to a folder
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
+from typing import Optional
+
+from candidate_store import CandidateStore, get_files_signature
+from extraction_sandbox import get_extraction_sandbox
+from file_processing import CandidateFile, build_candidate_index, get_file_role, get_id_from_filepath
+from instrumentation import get_metrics, increment
+from main import CandidateApplication, OUTPUT_FILENAME, get_all_candidate_applications, init_worker, process_candidate_in_worker, write_candidate_applications_in_place
+from pdf_processing import get_extraction_cache, get_extraction_options
+from scoring import rate_candidate_applications
+
+DEFAULT_POLL_INTERVAL_S = 2.0
+DEFAULT_SETTLE_S = 5.0
+
+
+class CandidateFolderWatcher:
+    """Watches a folder of candidate files and processes each candidate again as soon as its files are added, changed or removed.
+    New files are only processed once their size and modification time have not changed for `settle_s` seconds, so that files
+    still being copied are not read. The folder is polled every `poll_interval_s` seconds; if the `watchdog` package is installed,
+    file system events also trigger a poll straight away. Results are kept in `store` and the output csv is updated in place.
+    Args:
+        root (str): Folder containing the candidates' pdfs.
+        store (CandidateStore): Store of the processed candidates.
+        index_path (str): File where the index of the folder is saved.
+        max_workers (int): Number of worker processes used to process candidates.
+        poll_interval_s (float): Time between two polls of the folder, in seconds.
+        settle_s (float): Time without changes after which a file is considered completely written, in seconds.
+        output_format (str): "csv" or "parquet".
+    """
+
+    def __init__(self, root: str, store: CandidateStore, index_path: str, max_workers: int = 1,
+                 poll_interval_s: float = DEFAULT_POLL_INTERVAL_S, settle_s: float = DEFAULT_SETTLE_S, output_format: str = "csv"):
+        self.root = root
+        self.store = store
+        self.index_path = index_path
+        self.max_workers = max_workers
+        self.poll_interval_s = poll_interval_s
+        self.settle_s = settle_s
+        self.output_path = os.path.join(root, f"{OUTPUT_FILENAME}.{output_format}")
+
+        self._wakeup = threading.Event()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._index = None
+        self._seen: dict[str, tuple[int, int]] = {} # size and mtime of each file, as last listed in the index
+        self._unsettled: dict[str, tuple[int, int, float]] = {} # size and mtime of the files being written, and since when they are unchanged
+        self._candidate_apps: dict[int, CandidateApplication] = {}
+        self._in_progress: dict[Future, tuple[int, str]] = {} # candidate ID and files signature of each candidate being processed
+        self._to_resubmit: set[int] = set() # candidates whose files changed while they were being processed
+        self._to_retry_alone: set[int] = set() # candidates in progress when a worker died, retried one at a time
+
+    def _start_file_system_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print(f"watchdog is not installed, polling the folder every {self.poll_interval_s} s.")
+            return None
+
+        wakeup = self._wakeup
+
+        class WakeupHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+
+        observer = Observer()
+        observer.schedule(WakeupHandler(), self.root, recursive=True)
+        observer.start()
+        return observer
+
+    def run(self) -> None:
+        # Catch up with the files added since the last run.
+        self._index = build_candidate_index(self.root, self.index_path)
+        for cand_app in get_all_candidate_applications(self.root, max_workers=self.max_workers, store=self.store, index=self._index):
+            self._candidate_apps[cand_app.candidate_id] = cand_app
+        self._write_output()
+        self._seen = {f.path: (f.size, f.mtime_ns) for f in self._index.get_files()}
+
+        observer = self._start_file_system_observer()
+        print(f"Watching folder {self.root} for new candidate files.")
+        try:
+            self._start_executor()
+            while True:
+                self._wakeup.wait(self.poll_interval_s)
+                self._wakeup.clear()
+                self.poll()
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            self._index.save(self.index_path)
+
+    def _start_executor(self) -> None:
+        # Workers don't share this process' state, so hand them the extraction cache and sandbox explicitly.
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker,
+                                             initargs=(get_extraction_cache(), get_extraction_sandbox(), get_extraction_options()))
+
+    def _restart_executor(self) -> None:
+        # A worker that dies, e.g. killed for using too much memory, breaks the whole pool: its candidates in progress fail, and are
+        # collected as crashed by _collect.
+        print("A worker process died, restarting the worker processes.")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._start_executor()
+
+    def poll(self) -> None:
+        """Look for changed files, submit the candidates whose files have settled and collect the finished candidates."""
+        now = time.monotonic()
+        self._index.refresh()
+        listed = {f.path: (f.size, f.mtime_ns) for f in self._index.get_files()}
+
+        changed_candidates: set[int] = set()
+        for path, state in listed.items():
+            if self._seen.get(path) != state:
+                self._seen[path] = state
+                self._unsettled[path] = (*state, now)
+        for path in [p for p in self._seen if p not in listed]:
+            del self._seen[path]
+            self._unsettled.pop(path, None)
+            changed_candidates.add(get_id_from_filepath(path))
+
+        # Check the files being written directly, as the index is not refreshed when a file changes but its folder doesn't.
+        for path, (size, mtime_ns, unchanged_since) in list(self._unsettled.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._unsettled[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._unsettled[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif now - unchanged_since >= self.settle_s:
+                del self._unsettled[path]
+                changed_candidates.add(get_id_from_filepath(path))
+
+        # Wait until all the files of a candidate have settled.
+        unsettled_candidates = {get_id_from_filepath(p) for p in self._unsettled}
+        for candidate_id in changed_candidates - unsettled_candidates:
+            self._submit(candidate_id)
+        self._to_resubmit |= changed_candidates & unsettled_candidates
+
+        self._collect()
+
+    def _submit(self, candidate_id: int) -> None:
+        if any(in_progress_id == candidate_id for in_progress_id, _ in self._in_progress.values()):
+            self._to_resubmit.add(candidate_id)
+            return
+        self._to_resubmit.discard(candidate_id)
+        self._to_retry_alone.discard(candidate_id)
+
+        files = []
+        for path in sorted(p for p in self._seen if get_id_from_filepath(p) == candidate_id):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue # removed or renamed since the last poll, which the next poll picks up
+            files.append(CandidateFile(path, get_file_role(path), stat.st_size, stat.st_mtime_ns))
+        pdfs_paths = [f.path for f in files]
+        if not pdfs_paths:
+            print(f"All files of candidate {candidate_id} were removed.")
+            self.store.remove([candidate_id])
+            if self._candidate_apps.pop(candidate_id, None) is not None:
+                self._write_output()
+            return
+
+        signature = get_files_signature(files)
+        if self.store.is_up_to_date(candidate_id, signature):
+            return # e.g. a file was touched, or saved again without changes
+
+        print(f"Queueing candidate {candidate_id} with {len(pdfs_paths)} pdfs.")
+        try:
+            future = self._executor.submit(process_candidate_in_worker, candidate_id, pdfs_paths)
+        except BrokenProcessPool:
+            self._restart_executor()
+            future = self._executor.submit(process_candidate_in_worker, candidate_id, pdfs_paths)
+        self._in_progress[future] = (candidate_id, signature)
+
+    def _collect(self) -> None:
+        done = [future for future in self._in_progress if future.done()]
+        collected = []
+        crashed = []
+        for future in done:
+            candidate_id, signature = self._in_progress.pop(future)
+            try:
+                cand_app, worker_metrics = future.result()
+                get_metrics().merge(worker_metrics)
+            except Exception as e:
+                # Only reached if a worker died, as file errors are handled in process_candidate. All the candidates in progress in
+                # the pool fail then, not only the one that killed its worker.
+                print(f"Error processing candidate {candidate_id}. Error: {type(e).__name__} {e.args}")
+                increment("worker_crashes")
+                cand_app = CandidateApplication(candidate_id=candidate_id, has_processing_errors=True)
+                crashed.append(candidate_id)
+            collected.append((candidate_id, signature, cand_app))
+
+        # Rated at once, with the rating weights of this process.
+        rate_candidate_applications([cand_app for _, _, cand_app in collected])
+        for candidate_id, signature, cand_app in collected:
+            self.store.put(candidate_id, signature, asdict(cand_app))
+            self._candidate_apps[candidate_id] = cand_app
+        # Retried up to MAX_PROCESSING_ATTEMPTS times, so that a candidate that always kills its worker is eventually given up.
+        self._to_retry_alone |= set(crashed) & self.store.get_retry_ids()
+
+        if done:
+            self._write_output()
+        for candidate_id in list(self._to_resubmit):
+            if candidate_id not in {get_id_from_filepath(p) for p in self._unsettled}:
+                self._submit(candidate_id)
+        # Alone in the pool, a candidate that kills its worker doesn't fail the others again.
+        if self._to_retry_alone and not self._in_progress:
+            self._submit(min(self._to_retry_alone))
+
+    def _write_output(self) -> None:
+        write_candidate_applications_in_place(list(self._candidate_apps.values()), self.output_path)
+        print(f"Updated {self.output_path} with {len(self._candidate_apps)} candidate applications.")
+
+
+# %%
+
+if __name__ == "__main__":
+    import argparse
+
+    from candidate_store import DEFAULT_STORE_FILENAME
+    from file_processing import DEFAULT_INDEX_FILENAME
+    from main import add_extraction_arguments, add_output_arguments, configure_extraction, write_metrics
+
+    parser = argparse.ArgumentParser(description="Process candidate applications continuously, as their files are added to a folder.")
+    parser.add_argument("root", help="Folder containing the candidates' pdfs.")
+    add_extraction_arguments(parser)
+    add_output_arguments(parser)
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL_S, help="Time between two polls of the folder, in seconds.")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_S,
+                        help="Time without changes after which a file is considered completely written, in seconds.")
+    parser.add_argument("--state-db", default=None, help="SQLite file storing the processed candidates. Defaults to a file in the root folder.")
+    args = parser.parse_args()
+    configure_extraction(args)
+    if args.weights:
+        from scoring import RatingWeights, set_rating_weights
+        set_rating_weights(RatingWeights.load(args.weights))
+
+    with CandidateStore(args.state_db or os.path.join(args.root, DEFAULT_STORE_FILENAME)) as store:
+        watcher = CandidateFolderWatcher(args.root, store, os.path.join(args.root, DEFAULT_INDEX_FILENAME), max_workers=args.workers,
+                                         poll_interval_s=args.poll_interval, settle_s=args.settle, output_format=args.output_format)
+        try:
+            watcher.run()
+        finally:
+            # Metrics of the whole session, written when the watcher stops.
+            write_metrics(args)